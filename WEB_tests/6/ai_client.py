@@ -0,0 +1,309 @@
+# ai_client.py
+import os
+import time
+import asyncio
+import random
+import logging
+import threading
+import openai
+from llm_cache import make_key
+from metrics import metrics
+
+# ---- Configurable limits ----
+# Defaults match a low OpenAI tier; raise them in .env for higher quotas.
+# Every process meters its own buckets, so each one only gets OPENAI_QUOTA_SHARE
+# of the account quota: give the web app, the scheduler and jobs.py shares
+# that add up to 1 (jobs.py splits its share between its worker processes)
+QUOTA_SHARE = float(os.getenv("OPENAI_QUOTA_SHARE", "1"))
+RPM_LIMIT = int(os.getenv("OPENAI_RPM", "500")) * QUOTA_SHARE
+TPM_LIMIT = int(os.getenv("OPENAI_TPM", "30000")) * QUOTA_SHARE
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+BASE_DELAY = 1.0   # seconds, first backoff step
+MAX_DELAY = 60.0   # seconds, backoff ceiling
+
+# Completion size assumed when a call does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 800
+
+# Errors worth retrying; anything else (bad request, auth) is raised at once
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    Refills continuously at per_minute / 60 units per second up to per_minute.
+    reserve() always takes the amount (the level may go negative) and returns
+    how long the caller has to wait, so concurrent callers queue up fairly.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Give back (positive) or take extra (negative) once real usage is known."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+def _retry_after(error) -> float | None:
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # HTTP-date form, fall back to our own backoff
+    return None
+
+
+class _ClientLimits:
+    """
+    What the sync and the async client share: the RPM / TPM buckets, the
+    backoff, the global pause after a 429, and the counters and metrics.
+    """
+
+    def __init__(self, client, rpm=RPM_LIMIT, tpm=TPM_LIMIT, max_retries=MAX_RETRIES, cache=None):
+        self.client = client
+        self.cache = cache
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "throttled_seconds": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _estimate_tokens(self, kwargs) -> int:
+        # ~4 characters per token is close enough for budgeting
+        chars = sum(len(m.get("content") or "") for m in kwargs.get("messages", []))
+        return chars // 4 + kwargs.get("max_tokens", DEFAULT_COMPLETION_TOKENS)
+
+    def _capacity_wait(self, estimate: int) -> float:
+        wait = max(
+            self.requests.reserve(1),
+            self.tokens.reserve(estimate),
+            self._pause_until - time.monotonic(),
+        )
+        if wait > 0:
+            self._count("throttled_seconds", wait)
+        return wait
+
+    def _backoff(self, attempt: int, error) -> float:
+        delay = min(MAX_DELAY, BASE_DELAY * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if isinstance(error, openai.RateLimitError):
+            # everyone else should stop hammering the API as well
+            with self._lock:
+                self._pause_until = max(self._pause_until, time.monotonic() + delay)
+        return delay
+
+    def _failed(self, site, kwargs, started, retries):
+        self._count("failed")
+        metrics.observe_call(site, kwargs.get("model"), time.perf_counter() - started, retries=retries, failed=True)
+
+    def _record_usage(self, usage, estimate):
+        if usage is None:
+            return
+        self._count("prompt_tokens", usage.prompt_tokens)
+        self._count("completion_tokens", usage.completion_tokens)
+        self.tokens.adjust(estimate - usage.total_tokens)
+
+    def _succeeded(self, site, kwargs, response, estimate, started, retries):
+        self._count("succeeded")
+        usage = getattr(response, "usage", None)
+        self._record_usage(usage, estimate)
+        metrics.observe_call(
+            site, getattr(response, "model", None) or kwargs.get("model"),
+            time.perf_counter() - started, usage=usage, retries=retries
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+        out["throttled_seconds"] = round(out["throttled_seconds"], 3)
+        out["rpm_available"] = round(self.requests.level, 1)
+        out["tpm_available"] = round(self.tokens.level, 1)
+        if self.cache is not None:
+            out["cache"] = self.cache.stats()
+        return out
+
+
+class RateLimitedClient(_ClientLimits):
+    """
+    Shared wrapper around openai.OpenAI for every chat completion call.
+    Requests and tokens are metered by two buckets (RPM / TPM); retryable
+    errors back off exponentially with jitter, honouring Retry-After.
+    A 429 pauses all callers, not only the one that received it.
+    complete() additionally answers repeated requests from an optional ResponseCache.
+    """
+
+    def _wait_for_capacity(self, estimate: int) -> None:
+        wait = self._capacity_wait(estimate)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _request(self, kwargs, estimate, site, started):
+        # the retry loop shared by create() and stream(); returns (response, retries)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_capacity(estimate)
+            self._count("requests")
+            try:
+                return self.client.chat.completions.create(**kwargs), attempt
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                if attempt == self.max_retries:
+                    self._failed(site, kwargs, started, attempt)
+                    raise
+                delay = self._backoff(attempt, e)
+                logging.warning("OpenAI call failed (%s), retry %d in %.1fs", type(e).__name__, attempt + 1, delay)
+                self._count("retries")
+                time.sleep(delay)
+            except Exception:
+                self._failed(site, kwargs, started, attempt)
+                raise
+
+    def create(self, site="unknown", **kwargs):
+        """
+        Drop-in for client.chat.completions.create(**kwargs).
+        site names the caller in the metrics (e.g. "new_topic").
+        """
+        started = time.perf_counter()
+        estimate = self._estimate_tokens(kwargs)
+        response, retries = self._request(kwargs, estimate, site, started)
+        self._succeeded(site, kwargs, response, estimate, started, retries)
+        return response
+
+    def stream(self, site="unknown", **kwargs):
+        """
+        Streamed completion: yields the message text piece by piece as it arrives.
+        Retries only cover opening the stream; an error mid-stream is raised.
+        """
+        started = time.perf_counter()
+        kwargs = {**kwargs, "stream": True, "stream_options": {"include_usage": True}}
+        estimate = self._estimate_tokens(kwargs)
+        chunks, retries = self._request(kwargs, estimate, site, started)
+        usage = None
+        model = kwargs.get("model")
+        try:
+            for chunk in chunks:
+                model = getattr(chunk, "model", None) or model
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                    self._record_usage(usage, estimate)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception:
+            self._failed(site, kwargs, started, retries)
+            raise
+        self._count("succeeded")
+        metrics.observe_call(site, model, time.perf_counter() - started, usage=usage, retries=retries)
+
+    def complete(self, site="unknown", cached=True, **kwargs) -> str:
+        """
+        Like create(), but returns only the message text. Identical requests
+        (same model, messages and parameters) are served from the cache.
+        Pass cached=False when a new answer is the point of the call, e.g.
+        regenerating an article: the cached one is what was judged stale.
+        """
+        if not cached or self.cache is None or not self.cache.enabled:
+            return self.create(site, **kwargs).choices[0].message.content
+        key = make_key(kwargs)
+        content = self.cache.get(key)
+        if content is None:
+            content = self.create(site, **kwargs).choices[0].message.content
+            self.cache.set(key, content, model=kwargs.get("model"))
+        else:
+            metrics.count("llm_cache_hits_total", site=site)
+        return content
+
+
+class AsyncRateLimitedClient(_ClientLimits):
+    """
+    The same limits, retries, cache and metrics around openai.AsyncOpenAI,
+    for the ASGI app (asgi.py). Waiting for capacity or for a retry
+    suspends only the calling request, not the event loop. There is no
+    stream(): streaming generation is served by the Flask app.
+    Give it a memory-only ResponseCache: the Mongo tier would block the loop.
+    """
+
+    async def _request(self, kwargs, estimate, site, started):
+        for attempt in range(self.max_retries + 1):
+            wait = self._capacity_wait(estimate)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._count("requests")
+            try:
+                return await self.client.chat.completions.create(**kwargs), attempt
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    self._count("rate_limited")
+                if attempt == self.max_retries:
+                    self._failed(site, kwargs, started, attempt)
+                    raise
+                delay = self._backoff(attempt, e)
+                logging.warning("OpenAI call failed (%s), retry %d in %.1fs", type(e).__name__, attempt + 1, delay)
+                self._count("retries")
+                await asyncio.sleep(delay)
+            except Exception:
+                self._failed(site, kwargs, started, attempt)
+                raise
+
+    async def create(self, site="unknown", **kwargs):
+        started = time.perf_counter()
+        estimate = self._estimate_tokens(kwargs)
+        response, retries = await self._request(kwargs, estimate, site, started)
+        self._succeeded(site, kwargs, response, estimate, started, retries)
+        return response
+
+    async def complete(self, site="unknown", cached=True, **kwargs) -> str:
+        if not cached or self.cache is None or not self.cache.enabled:
+            return (await self.create(site, **kwargs)).choices[0].message.content
+        key = make_key(kwargs)
+        content = self.cache.get(key)
+        if content is None:
+            content = (await self.create(site, **kwargs)).choices[0].message.content
+            self.cache.set(key, content, model=kwargs.get("model"))
+        else:
+            metrics.count("llm_cache_hits_total", site=site)
+        return content
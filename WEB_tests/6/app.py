@@ -1,34 +1,70 @@
-from flask import Flask, request, render_template, redirect, jsonify, session, url_for
+import os
+import json
+from flask import Flask, Response, request, render_template, redirect, jsonify, session, url_for, stream_with_context
 from bson.objectid import ObjectId
 from werkzeug.security import generate_password_hash, check_password_hash
 from news import (
-    new_topic,
+    stream_new_topic,
     search_by_keyword,
-    full_update,
-    topics,
+    text_search,
+    AI_client,
     topic_updates,
     get_popular_updates,
+    feed_cards_ready,
     add_voting_keyword,
     vote_keyword,
-    get_voting_keywords,
-    clear_voting
+    get_voting_keywords
 )
 from users import (
     create_user,
-    get_user,
-    use_token,
-    reset_all_tokens
+    get_user
 )
+from indexes import ensure_indexes
+from jobs import enqueue, get_job
+from metrics import metrics, MetricsPublisher, combined, published, process_id
+from database import metrics_store
+from page_cache import page_cache
+from views import view_buffer
+from articles import ARTICLE_GROUPS
+from queries import feed_items
+import profiling
 from security import (
     validate_topic_list,
     validate_keyword,
-    safe_object_id
+    validate_search_query,
+    safe_object_id,
+    parse_utc_date
 )
 
 app = Flask(__name__)
 app.secret_key = "super-secret"
 ADMIN_PASSWORD = "changeme"
 
+# Server-Timing headers and slow-endpoint stats; off unless PROFILE_REQUESTS=1 or enabled at /admin/profiling
+profiling.install(app)
+
+# Create any missing indexes on startup (idempotent); set ENSURE_INDEXES=0 to skip
+if os.getenv("ENSURE_INDEXES", "1") == "1":
+    ensure_indexes()
+# the feed reads Topic_updates until `migrations.py feed-cards` has run; this logs a warning meanwhile
+feed_cards_ready()
+
+# Other web processes report this one's LLM calls too (jobs.py and scheduler.py publish theirs)
+MetricsPublisher(metrics_store, "web", extra=AI_client.stats).start()
+
+
+# --- Conditional GET helpers ---
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    # browsers keep the copy but revalidate it on every fetch
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(etag):
+    metrics.count("page_cache_total", result="not_modified")
+    return _cacheable(Response(status=304), etag)
+
 
 # --- Home ---
 @app.route('/')
@@ -40,37 +76,84 @@ def home():
 @app.route('/search', methods=['GET'])
 def search():
     keywords = request.args.get('keyword', '')
+    cursor = request.args.get('cursor')
+    mode = request.args.get('mode', 'keyword')
+
+    if mode == 'text':
+        # full-text: phrases and prefixes are allowed, results ranked by relevance
+        try:
+            validate_search_query(keywords)
+        except ValueError:
+            return render_template('search.html', keyword=keywords, mode=mode, result=[], error="Invalid search term")
+        results, next_cursor = text_search(keywords, cursor=cursor)
+        return render_template('search.html', keyword=keywords.strip(), mode=mode, result=results, next_cursor=next_cursor)
+
     try:
         validated = validate_keyword(keywords)
     except ValueError:
-        return render_template('search.html', keyword=keywords, result=[], error="Invalid search term")
-    results = search_by_keyword(validated)
-    return render_template('search.html', keyword=validated, result=results)
+        return render_template('search.html', keyword=keywords, mode='keyword', result=[], error="Invalid search term")
+    results, next_cursor = search_by_keyword(validated, cursor=cursor)
+    return render_template('search.html', keyword=validated, mode='keyword', result=results, next_cursor=next_cursor)
 
 
 # --- API feed ---
 @app.route('/api/news')
 def api_news():
-    page = int(request.args.get("page", 1))
+    cursor = request.args.get("cursor")
     per_page = 10
-    skip = (page - 1) * per_page
     group = request.args.get("group", "Home")
 
-    if group == "Home":
-        updates = get_popular_updates(skip, per_page)
-    else:
-        updates = list(topic_updates.find({"group": group}).sort("update_time", -1).skip(skip).limit(per_page))
+    try:
+        # optional ISO dates, e.g. ?since=2025-01-01&until=2025-02-01 (UTC)
+        since = parse_utc_date(request.args.get("since"))
+        until = parse_utc_date(request.args.get("until"))
+    except ValueError:
+        return jsonify({"error": "Invalid date"}), 400
+    # only known groups get a cache entry, anything else is rejected up front
+    if group != "Home" and group not in ARTICLE_GROUPS:
+        return jsonify({"error": "Unknown group"}), 400
+
+    feed_group = None if group == "Home" else group
+    # the ETag changes whenever a newer update lands in the group, so unchanged pages cost one indexed lookup
+    etag = page_cache.feed_etag(feed_group, cursor, per_page, since, until)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    key = f"feed:{feed_group}:{etag}"
+    body = page_cache.get(key)
+    if body is None:
+        try:
+            updates, next_cursor = get_popular_updates(
+                cursor, per_page, group=feed_group, since=since, until=until
+            )
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+        body = app.json.dumps({"items": feed_items(updates), "next_cursor": next_cursor})
+        page_cache.set(key, body)
+
+    return _cacheable(Response(body, mimetype="application/json"), etag)
+
 
-    items = []
-    for u in updates:
-        items.append({
-            "id": str(u["_id"]),
-            "headline": u["name"],
-            "summary": u["summary"],
-            "time": u["update_time"]
-        })
+# --- OpenAI usage counters ---
+@app.route('/api/ai_stats')
+def api_ai_stats():
+    # this process's client, every process's last published counters, and their sum
+    stats = AI_client.stats()
+    processes = [{"process": process_id(), "role": "web", **stats}] + [
+        {"process": doc["_id"], "role": doc["role"], "updated_at": doc["updated_at"], **doc["extra"]}
+        for doc in published(metrics_store) if doc.get("extra")
+    ]
+    stats["total"] = {name: round(sum(p.get(name, 0) for p in processes), 3) for name in AI_client.counters}
+    stats["processes"] = processes
+    return jsonify(stats)
 
-    return jsonify(items)
+
+# --- Prometheus metrics ---
+@app.route('/metrics')
+def prometheus_metrics():
+    # every process: web, job workers and scheduler (see metrics.MetricsPublisher)
+    return Response(combined(metrics_store).prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 # --- Article detail ---
@@ -81,11 +164,22 @@ def article(id):
     except ValueError:
         return "Invalid article id", 400
 
-    article = topic_updates.find_one({"_id": oid})
-    if not article:
+    meta = topic_updates.find_one({"_id": oid}, {"topic_id": 1, "update_time": 1, "rev": 1})
+    if not meta:
         return "Article not found", 404
-    topic = topics.find_one({"_id": article["topic_id"]})
-    return render_template("article.html", article=article, topic=topic)
+    # count the read: much-read topics get refreshed more often (see news.refresh_interval)
+    view_buffer.add(meta["topic_id"])
+    etag = page_cache.article_etag(meta)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    key = f"article:{etag}"
+    html = page_cache.get(key)
+    if html is None:
+        article = topic_updates.find_one({"_id": oid})
+        html = render_template("article.html", article=article)
+        page_cache.set(key, html)
+    return _cacheable(Response(html, mimetype="text/html"), etag)
 
 
 # --- Filter by group ---
@@ -94,6 +188,69 @@ def filter_news(group):
     return render_template('index.html', selected_group=group)
 
 
+# --- Admin auth ---
+@app.route("/admin_login", methods=["GET", "POST"])
+def admin_login():
+    if request.method == "POST":
+        password = request.form.get("password")
+        if password == ADMIN_PASSWORD:
+            session["admin"] = True
+            target = request.args.get("next", "")
+            # only follow local paths, never another host
+            return redirect(target if target.startswith("/") and not target.startswith("//") else url_for("home"))
+        else:
+            return render_template("admin_login.html", error="Invalid password")
+    return render_template("admin_login.html")
+
+
+@app.route("/admin_logout")
+def admin_logout():
+    session.pop("admin", None)
+    return redirect(url_for("home"))
+
+
+# --- Request profiling (admin only) ---
+@app.route("/admin/profiling")
+def admin_profiling():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login", next=request.full_path))
+    # e.g. /admin/profiling?enabled=1&sample=0.01 to also dump 1% of requests with cProfile
+    enabled = request.args.get("enabled")
+    try:
+        sample = float(request.args["sample"]) if "sample" in request.args else None
+        top = min(int(request.args.get("top", 10)), 100)
+    except ValueError:
+        return jsonify({"error": "Invalid parameter"}), 400
+    settings = profiling.configure(
+        enabled=None if enabled is None else enabled == "1",
+        sample_rate=sample
+    )
+    return jsonify({"settings": settings, "slow_endpoints": profiling.slow_endpoints(top)})
+
+
+# --- Streaming generation (admin only) ---
+@app.route("/api/generate/stream")
+def generate_stream():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login", next=request.full_path))
+    keyword = request.args.get("keyword", "")
+    try:
+        validated = validate_topic_list(keyword)
+    except ValueError:
+        return "Invalid keyword", 400
+
+    # server-sent events: headline and summary arrive long before the body is done
+    def events():
+        for event, data in stream_new_topic(",".join(validated), created_by="admin"):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # --- User auth ---
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -133,8 +290,9 @@ def voting():
         return redirect(url_for("login"))
 
     user = get_user(session["username"])
-    keywords = get_voting_keywords()
-    return render_template("voting.html", keywords=keywords, user=user)
+    page = max(request.args.get("page", 0, type=int), 0)
+    keywords, has_more = get_voting_keywords(page)
+    return render_template("voting.html", keywords=keywords, user=user, page=page, has_more=has_more)
 
 
 @app.route("/submit_keyword", methods=["POST"])
@@ -147,8 +305,8 @@ def submit_keyword():
     except ValueError:
         return "Invalid keyword", 400
 
-    if validated_kw and use_token(session["username"]):
-        add_voting_keyword(validated_kw, session["username"])
+    # the token is only spent if the keyword is stored, and vice versa
+    if validated_kw and add_voting_keyword(validated_kw, session["username"]):
         return redirect(url_for("voting"))
 
     return "Not enough tokens"
@@ -158,33 +316,47 @@ def submit_keyword():
 def vote_keyword_route(id):
     if "username" not in session:
         return redirect(url_for("login"))
-    if use_token(session["username"]):
-        vote_keyword(id)
-        return redirect(url_for("voting"))
-    return "No tokens left"
+    try:
+        oid = safe_object_id(id)
+    except ValueError:
+        return "Invalid keyword id", 400
+    counted = vote_keyword(oid, session["username"])
+    if counted is None:
+        return "No tokens left"
+    if not counted:
+        return "Keyword not found", 404
+    return redirect(url_for("voting"))
 
 
-# --- Weekly winners ---
-@app.route("/weekly_winners")
-def weekly_winners():
-    top_keywords = get_voting_keywords()[:5]
-    for k in top_keywords:
-        try:
-            toks = validate_topic_list(k["keyword"])
-        except ValueError:
-            continue
-        new_topic(",".join(toks), created_by=k["created_by"])
+# --- Background jobs ---
+def _job_accepted(job_id):
+    return jsonify({"job_id": str(job_id), "status_url": url_for("job_status", id=str(job_id))}), 202
 
-    reset_all_tokens()
-    clear_voting()
 
-    return redirect(url_for("voting"))
+@app.route("/weekly_winners")
+def weekly_winners():
+    # generation takes minutes; a worker from jobs.py does it (see news.run_weekly_winners)
+    job_id, _ = enqueue("weekly_winners")
+    return _job_accepted(job_id)
 
 
-# --- Topics update ---
 @app.route("/update")
 def update():
-    full_update()
+    job_id, _ = enqueue("full_update")
+    return _job_accepted(job_id)
+
+
+@app.route("/api/jobs/<id>")
+def job_status(id):
+    try:
+        oid = safe_object_id(id)
+    except ValueError:
+        return jsonify({"error": "Invalid job id"}), 400
+    job = get_job(oid)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    job["_id"] = str(job["_id"])
+    return jsonify(job)
 
 
 if __name__ == '__main__':
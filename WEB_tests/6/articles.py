@@ -0,0 +1,128 @@
+# articles.py
+# What an article request looks like and how its reply becomes an update:
+# prompts, the JSON schema of structured mode, and a validating parser with
+# a free-text fallback. Shared by news.py and the async app (asgi.py).
+import os
+import re
+import json
+import logging
+from metrics import metrics
+from security import sanitize_ai_output
+
+ARTICLE_MODEL = "gpt-4o"
+ARTICLE_PROMPT = (
+    "You are a journalist writing in a news style. Max 500 words. "
+    "Make the first lane only one word that will categorise the article into one of these 6 groups:"
+    "[Politics_Conflicts, Economy_Business, Science_Technology, Environment_Climate, Sports, Culture_Society]"
+    "After that leave a empty line and make the next line a headline. Then leave an empty line and write a brief summary. "
+    "After that leave another empty line and write the rest of the article and leave two empty lines at the end. "
+    "After that list the sources. Each source in next line starting with a dash. Do not include any URLs."
+)
+
+ARTICLE_GROUPS = [
+    "Politics_Conflicts", "Economy_Business", "Science_Technology",
+    "Environment_Climate", "Sports", "Culture_Society"
+]
+# JSON-schema structured replies by default; ARTICLE_STRUCTURED=0 goes back to the free-text format
+ARTICLE_STRUCTURED = os.getenv("ARTICLE_STRUCTURED", "1") == "1"
+ARTICLE_JSON_PROMPT = (
+    "You are a journalist writing in a news style. Max 500 words. "
+    "Put the article into exactly one of the 6 groups, write a headline, a brief summary "
+    "and the rest of the article as the body, and list your sources. Do not include any URLs."
+)
+ARTICLE_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "article",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "group": {"type": "string", "enum": ARTICLE_GROUPS},
+                "headline": {"type": "string"},
+                "summary": {"type": "string"},
+                "body": {"type": "string"},
+                "sources": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["group", "headline", "summary", "body", "sources"],
+            "additionalProperties": False
+        }
+    }
+}
+# "Science & Technology", "science_technology", ... all mean Science_Technology
+_GROUP_KEYS = {re.sub(r"[^a-z]", "", g.lower()): g for g in ARTICLE_GROUPS}
+
+
+def article_messages(user_topics, prompt=ARTICLE_PROMPT):
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": f"Can you tell me some news about the {user_topics}?"}
+    ]
+
+
+def article_request(user_topics):
+    # model, messages and (in structured mode) response_format of an article completion
+    if not ARTICLE_STRUCTURED:
+        return {"model": ARTICLE_MODEL, "messages": article_messages(user_topics)}
+    return {
+        "model": ARTICLE_MODEL,
+        "messages": article_messages(user_topics, ARTICLE_JSON_PROMPT),
+        "response_format": ARTICLE_SCHEMA
+    }
+
+
+def parse_failure(reason, detail):
+    metrics.count("article_parse_failures_total", reason=reason)
+    logging.warning("Article reply: %s (%s)", detail, reason)
+
+
+def valid_group(raw):
+    # one of ARTICLE_GROUPS, or "" (the update then only shows on the home feed)
+    group = _GROUP_KEYS.get(re.sub(r"[^a-z]", "", (raw or "").lower()))
+    if group is None:
+        parse_failure("unknown_group", f"group {raw!r} is not one of the 6 groups")
+        return ""
+    return group
+
+
+def _article_fields(raw_content):
+    """
+    (group, headline, summary, body) of a completion: the JSON object of
+    structured mode, or else the blank-line separated text format, split once.
+    """
+    text = raw_content.strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            fields = [data["group"], data["headline"], data["summary"], data["body"]]
+            sources = data.get("sources") or []
+            if not isinstance(sources, list) or not all(isinstance(v, str) for v in fields + sources):
+                raise TypeError("article fields must be strings")
+            if sources:
+                # same layout as the text format: sources after two empty lines
+                fields[3] += "\n\n\n" + "\n".join(f"- {source}" for source in sources)
+            return tuple(fields)
+        except (ValueError, KeyError, TypeError):
+            parse_failure("invalid_json", "not a valid article object, parsing it as text")
+    elif ARTICLE_STRUCTURED:
+        parse_failure("not_json", "expected a JSON object, parsing it as text")
+
+    paras = text.split("\n\n")
+    group = paras[0].split("\n")[0].strip(" #*") if paras else ""
+    headline = paras[1].strip().split("\n")[0].strip(" #*") if len(paras) > 1 else ""
+    summary = paras[2] if len(paras) > 2 else ""
+    return group, headline, summary, "\n\n".join(paras[3:])
+
+
+def parse_article(raw_content):
+    """
+    group, headline, summary and body of a completion, sanitized for the DB.
+    Raises ValueError when the headline or summary is missing; parse problems
+    are counted in article_parse_failures_total (see /metrics) by reason.
+    """
+    group, headline, summary, body = _article_fields(raw_content)
+    if not headline.strip() or not summary.strip():
+        parse_failure("missing_fields", "no headline or summary")
+        raise ValueError("Article reply has no headline or summary")
+    # sanitize AI outputs before writing to DB
+    return sanitize_ai_output(valid_group(group), headline, summary, body)
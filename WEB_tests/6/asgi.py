@@ -0,0 +1,320 @@
+# asgi.py
+# Async serving mode: the read-heavy routes and topic creation run on motor and
+# openai.AsyncOpenAI, so a slow MongoDB query or a generation in flight never
+# pins a worker. Queries come from queries.py and articles from articles.py,
+# exactly as in the Flask app; voting and the writes of a new update call the
+# news.py functions on the thread pool. Every other route (login, admin, jobs,
+# streaming) is passed through to the Flask app, which keeps serving them unchanged.
+#   uvicorn asgi:app --workers 2
+import os
+import openai
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.middleware.wsgi import WSGIMiddleware
+from starlette.concurrency import run_in_threadpool
+from flask import render_template
+from itsdangerous import BadSignature
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import BaseModel
+from ai_client import AsyncRateLimitedClient
+from llm_cache import ResponseCache
+from page_cache import page_cache, newest_query, revision_id
+from metrics import metrics
+from articles import ARTICLE_GROUPS, article_request, parse_article
+from news import insert_update, add_voting_keyword, vote_keyword, get_voting_keywords
+from views import view_buffer
+from queries import (
+    SEARCH_PAGE_SIZE,
+    SEARCH_FIELDS,
+    FEED_FIELDS,
+    UPDATE_FEED_FIELDS,
+    NEWEST_FIRST,
+    split_page,
+    score_page,
+    feed_query,
+    update_cards,
+    feed_items,
+    keyword_query,
+    keyword_results,
+    text_query,
+    text_results
+)
+from security import (
+    validate_topic_list,
+    validate_keyword,
+    validate_search_query,
+    safe_object_id,
+    parse_utc_date
+)
+from app import app as flask_app
+
+# Same database as database.py, through the async driver
+mongo = AsyncIOMotorClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
+adb = mongo[os.getenv("MONGO_DB", "News")]
+topics = adb["Topics"]
+topic_updates = adb["Topic_updates"]
+feed_cards = adb["Feed_cards"]
+feed_revisions = adb["Feed_revisions"]
+users = adb["Users"]
+
+# Memory-only response cache: the Mongo tier of ResponseCache is blocking
+AI_client = AsyncRateLimitedClient(
+    openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL") or None,
+        max_retries=0
+    ),
+    cache=ResponseCache()
+)
+
+app = FastAPI(title="topicai")
+
+
+# --- Helpers ---
+async def _page(cursor, limit):
+    # async twin of news._page
+    return split_page(await cursor.limit(limit + 1).to_list(limit + 1), limit)
+
+
+_cards_ready = False
+
+
+async def _feed_cards_ready():
+    # async twin of news.feed_cards_ready (which warns about the missing backfill at startup)
+    global _cards_ready
+    if not _cards_ready:
+        _cards_ready = await feed_cards.find_one({}, {"_id": 1}) is not None
+    return _cards_ready
+
+
+def _session(request: Request) -> dict:
+    """The Flask session of the caller, read from the same signed cookie."""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def _render(request: Request, template, **context) -> str:
+    # the templates use Flask's url_for; rendering itself does no I/O
+    with flask_app.test_request_context(request.url.path):
+        return render_template(template, **context)
+
+
+def _cacheable(response, etag):
+    response.headers["ETag"] = f'"{etag}"'
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(request: Request, etag):
+    if f'"{etag}"' not in request.headers.get("if-none-match", ""):
+        return None
+    metrics.count("page_cache_total", result="not_modified")
+    return _cacheable(Response(status_code=304), etag)
+
+
+# --- API feed ---
+@app.get("/api/news")
+async def api_news(request: Request, cursor: str | None = None, group: str = "Home",
+                   since: str | None = None, until: str | None = None):
+    per_page = 10
+    try:
+        since = parse_utc_date(since)
+        until = parse_utc_date(until)
+    except ValueError:
+        return JSONResponse({"error": "Invalid date"}, status_code=400)
+    if group != "Home" and group not in ARTICLE_GROUPS:
+        return JSONResponse({"error": "Unknown group"}, status_code=400)
+
+    feed_group = None if group == "Home" else group
+    version = page_cache.cached_version(feed_group)
+    if version is None:
+        query, fields, sort = newest_query(feed_group)
+        version = page_cache.remember_version(
+            feed_group,
+            await feed_cards.find_one(query, fields, sort=sort),
+            await feed_revisions.find_one({"_id": revision_id(feed_group)})
+        )
+    etag = page_cache.feed_etag(feed_group, cursor, per_page, since, until, version=version)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    key = f"feed:{feed_group}:{etag}"
+    body = page_cache.get(key)
+    if body is None:
+        try:
+            query = feed_query(cursor, feed_group, since, until)
+        except ValueError:
+            return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+        if await _feed_cards_ready():
+            updates, next_cursor = await _page(feed_cards.find(query, FEED_FIELDS).sort(NEWEST_FIRST), per_page)
+        else:
+            updates, next_cursor = await _page(topic_updates.find(query, UPDATE_FEED_FIELDS).sort(NEWEST_FIRST), per_page)
+            updates = update_cards(updates)
+        # same serialization as the Flask route
+        body = flask_app.json.dumps({"items": feed_items(updates), "next_cursor": next_cursor})
+        page_cache.set(key, body)
+
+    return _cacheable(Response(body, media_type="application/json"), etag)
+
+
+# --- Search ---
+async def _search_by_keyword(keyword, cursor):
+    # async twin of news.search_by_keyword
+    topic_ids = [t["_id"] async for t in topics.find({"keywords": keyword}, {"_id": 1})]
+    if not topic_ids:
+        return [], None
+    try:
+        query = keyword_query(topic_ids, cursor)
+    except ValueError:
+        return [], None
+    updates, next_cursor = await _page(topic_updates.find(query, SEARCH_FIELDS).sort(NEWEST_FIRST), SEARCH_PAGE_SIZE)
+    return keyword_results(updates), next_cursor
+
+
+async def _text_search(parsed, cursor):
+    # async twin of news.text_search
+    try:
+        kind, spec = text_query(parsed, SEARCH_PAGE_SIZE, cursor)
+    except ValueError:
+        return [], None
+    if kind == "find":
+        updates, next_cursor = await _page(topic_updates.find(spec, SEARCH_FIELDS).sort(NEWEST_FIRST), SEARCH_PAGE_SIZE)
+    else:
+        rows = await topic_updates.aggregate(spec).to_list(SEARCH_PAGE_SIZE + 1)
+        updates, next_cursor = score_page(rows, SEARCH_PAGE_SIZE)
+    return text_results(updates), next_cursor
+
+
+@app.get("/search", response_class=HTMLResponse)
+async def search(request: Request, keyword: str = "", cursor: str | None = None, mode: str = "keyword"):
+    if mode == "text":
+        try:
+            parsed = validate_search_query(keyword)
+        except ValueError:
+            return _render(request, "search.html", keyword=keyword, mode=mode, result=[], error="Invalid search term")
+        results, next_cursor = await _text_search(parsed, cursor)
+        return _render(request, "search.html", keyword=keyword.strip(), mode=mode, result=results, next_cursor=next_cursor)
+
+    try:
+        validated = validate_keyword(keyword)
+    except ValueError:
+        return _render(request, "search.html", keyword=keyword, mode="keyword", result=[], error="Invalid search term")
+    results, next_cursor = await _search_by_keyword(validated, cursor)
+    return _render(request, "search.html", keyword=validated, mode="keyword", result=results, next_cursor=next_cursor)
+
+
+# --- Article detail ---
+@app.get("/article/{id}")
+async def article(request: Request, id: str):
+    try:
+        oid = safe_object_id(id)
+    except ValueError:
+        return Response("Invalid article id", status_code=400)
+
+    meta = await topic_updates.find_one({"_id": oid}, {"topic_id": 1, "update_time": 1, "rev": 1})
+    if not meta:
+        return Response("Article not found", status_code=404)
+    view_buffer.add(meta["topic_id"])
+    etag = page_cache.article_etag(meta)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    key = f"article:{etag}"
+    html = page_cache.get(key)
+    if html is None:
+        doc = await topic_updates.find_one({"_id": oid})
+        html = _render(request, "article.html", article=doc)
+        page_cache.set(key, html)
+    return _cacheable(HTMLResponse(html), etag)
+
+
+# --- Voting system ---
+# tokens, transactions and the vote buffer live in news.py; these are short writes
+@app.get("/voting", response_class=HTMLResponse)
+async def voting_page(request: Request, page: int = 0):
+    username = _session(request).get("username")
+    if not username:
+        return RedirectResponse("/login", status_code=302)
+    user = await users.find_one({"username": username})
+    page = max(page, 0)
+    keywords, has_more = await run_in_threadpool(get_voting_keywords, page)
+    return _render(request, "voting.html", keywords=keywords, user=user, page=page, has_more=has_more)
+
+
+@app.post("/submit_keyword")
+async def submit_keyword(request: Request):
+    username = _session(request).get("username")
+    if not username:
+        return RedirectResponse("/login", status_code=302)
+    form = await request.form()
+    try:
+        validated_kw = validate_keyword(form.get("keyword", ""))
+    except ValueError:
+        return Response("Invalid keyword", status_code=400)
+
+    if validated_kw and await run_in_threadpool(add_voting_keyword, validated_kw, username):
+        return RedirectResponse("/voting", status_code=302)
+    return Response("Not enough tokens")
+
+
+@app.get("/vote_keyword/{id}")
+async def vote_keyword_route(request: Request, id: str):
+    username = _session(request).get("username")
+    if not username:
+        return RedirectResponse("/login", status_code=302)
+    try:
+        oid = safe_object_id(id)
+    except ValueError:
+        return Response("Invalid keyword id", status_code=400)
+    counted = await run_in_threadpool(vote_keyword, oid, username)
+    if counted is None:
+        return Response("No tokens left")
+    if not counted:
+        return Response("Keyword not found", status_code=404)
+    return RedirectResponse("/voting", status_code=302)
+
+
+# --- Topic creation API (admin only) ---
+class TopicRequest(BaseModel):
+    keywords: list[str]
+
+
+@app.post("/topics")
+async def create_topic(request: Request, body: TopicRequest):
+    """
+    Create (or reuse) the topic for these keywords and generate its first
+    update. Unlike new_topic, an existing topic is not re-scored first;
+    the refresh scheduler takes care of that.
+    """
+    if not _session(request).get("admin"):
+        return JSONResponse({"error": "Admin login required"}, status_code=401)
+    try:
+        user_topics = validate_topic_list(",".join(body.keywords))
+    except ValueError:
+        return JSONResponse({"error": "Invalid keywords"}, status_code=400)
+
+    try:
+        raw_content = await AI_client.complete(site="create_topic", cached=False, **article_request(user_topics))
+        safe = parse_article(raw_content)
+    except (openai.OpenAIError, ValueError):
+        return JSONResponse({"error": "Generation failed"}, status_code=502)
+
+    existing = await topics.find_one({"keywords": user_topics}, {"_id": 1})
+    # a new topic is created by insert_update, together with its first update
+    update_id = await run_in_threadpool(
+        insert_update, existing["_id"] if existing else None, safe, "admin", user_topics
+    )
+    update = await topic_updates.find_one({"_id": update_id}, {"topic_id": 1})
+    return JSONResponse({"topic_id": str(update["topic_id"]), "update_id": str(update_id)}, status_code=201)
+
+
+# Everything else: login, admin, jobs, streaming generation...
+app.mount("/", WSGIMiddleware(flask_app))
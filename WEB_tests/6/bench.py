@@ -0,0 +1,235 @@
+# bench.py
+# Offline benchmarks for the hot paths. Needs neither an OpenAI key nor production data:
+# completions come from fake_openai.py and MongoDB is mongomock (in memory) or a local mongod.
+#
+#   python bench.py --scale 1k
+#   python bench.py --scale 100k --mongo-uri mongodb://localhost:27017/ --json bench.json
+#   python bench.py --validators          # per-call cost of the input validators only
+# Data, picks and fake API behaviour are seeded (--seed), so runs at the same scale are comparable.
+import os
+import json
+import time
+import random
+import logging
+import timeit
+import argparse
+from datetime import datetime, timedelta, timezone
+from fake_openai import start_fake_server, fake_article, WORDS, GROUPS
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+UPDATES_PER_TOPIC = 10
+SEED_CHUNK = 10_000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(name, fn, runs, warmup=2):
+    """Call fn(i) `runs` times after a short warmup; latencies in ms, throughput in ops/s."""
+    for i in range(min(warmup, runs)):
+        fn(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(runs):
+        t0 = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    wall = time.perf_counter() - started
+    return {
+        "name": name,
+        "runs": runs,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "throughput": round(runs / wall, 1) if wall else 0.0
+    }
+
+
+def seed(database, n_updates):
+    """Fill Topics / Topic_updates / Feed_cards with synthetic data. Returns the keyword vocabulary."""
+    from bson.objectid import ObjectId
+    from queries import search_tokens
+
+    keywords = WORDS + [f"{a} {b}" for a, b in zip(WORDS, reversed(WORDS))]
+    n_topics = max(1, n_updates // UPDATES_PER_TOPIC)
+    topic_ids = [ObjectId() for _ in range(n_topics)]
+    for start in range(0, n_topics, SEED_CHUNK):
+        database.topics.insert_many([
+            {"_id": topic_id, "keywords": random.sample(keywords, 2)}
+            for topic_id in topic_ids[start:start + SEED_CHUNK]
+        ])
+
+    # a small pool of bodies is enough, documents only need realistic sizes
+    articles = [fake_article().split("\n\n") for _ in range(50)]
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    for start in range(0, n_updates, SEED_CHUNK):
+        docs = []
+        for i in range(start, min(n_updates, start + SEED_CHUNK)):
+            paras = random.choice(articles)
+            text = "\n\n".join(paras[3:])
+            docs.append({
+                "topic_id": topic_ids[i % n_topics],
+                "group": random.choice(GROUPS),
+                "name": paras[1],
+                "summary": paras[2],
+                "text": text,
+                "search_tokens": search_tokens(paras[1], paras[2], text),
+                "score": round(random.random(), 2),
+                "update_time": now - timedelta(seconds=random.randint(0, 90 * 24 * 3600)),
+                "created_by": None
+            })
+        database.topic_updates.insert_many(docs)
+        database.feed_cards.insert_many([database.feed_card(doc) for doc in docs])
+    return keywords
+
+
+# (validator, input) pairs: what searches, votes and topic creation send in practice
+VALIDATOR_CASES = [
+    ("validate_keyword", "climate change"),
+    ("validate_keyword", "a $where b"),
+    ("validate_topic_list", "ai, robotics"),
+    ("validate_topic_list", "ai, robotics, AI, space-x, climate change, energy, markets, elections"),
+    ("validate_topic_list", "x" * 190 + ", {bad}"),
+    ("validate_search_query", 'ukraine "peace talks" negot*'),
+]
+
+
+def bench_validators(number=100_000):
+    """Per-call cost of the security validators; needs no database or API."""
+    import security
+
+    logging.disable(logging.WARNING)  # rejected inputs would log on every call
+    results = []
+    for name, value in VALIDATOR_CASES:
+        fn = getattr(security, name)
+
+        def call():
+            try:
+                fn(value)
+            except ValueError:
+                pass
+
+        seconds = min(timeit.repeat(call, number=number, repeat=3)) / number
+        label = value if len(value) <= 40 else value[:37] + "..."
+        results.append({
+            "name": f"{name}({label!r})",
+            "runs": number,
+            "ns_per_call": round(seconds * 1e9),
+            "calls_per_s": round(1 / seconds)
+        })
+    logging.disable(logging.NOTSET)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark news hot paths offline")
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="number of seeded topic updates")
+    parser.add_argument("--mongo-uri", help="use a real mongod instead of mongomock")
+    parser.add_argument("--db", default="News_bench", help="database to (re)create for the run")
+    parser.add_argument("--runs", type=int, default=200, help="iterations per read benchmark")
+    parser.add_argument("--ai-runs", type=int, default=20, help="iterations per generation benchmark")
+    parser.add_argument("--refresh-topics", type=int, default=200, help="topics refreshed by the full_update benchmark")
+    parser.add_argument("--ai-latency", type=float, default=0.2, help="fake OpenAI mean latency (s)")
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42, help="seed of the data, the picks and the fake API")
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--validators", action="store_true", help="only run the validator micro-benchmark")
+    args = parser.parse_args()
+
+    if args.validators:
+        results = bench_validators()
+        print(f"{'validator':<72}{'ns/call':>10}{'calls/s':>12}")
+        for r in results:
+            print(f"{r['name']:<72}{r['ns_per_call']:>10}{r['calls_per_s']:>12}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"validators": results}, f, indent=2)
+        return
+
+    if args.db == "News":
+        parser.error("refusing to wipe the production database, pick another --db")
+
+    server, base_url = start_fake_server(
+        latency=args.ai_latency, jitter=args.ai_latency / 2, error_rate=args.ai_error_rate, seed=args.seed
+    )
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "bench",
+        "MONGO_DB": args.db,
+        "LLM_CACHE_TTL": "0",     # measure the API path, not the cache
+        "PAGE_CACHE_TTL": "0",    # and the feed queries, not cached pages
+        "ENSURE_INDEXES": "0",    # created below, after seeding
+    })
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        import pymongo
+        import mongomock
+        pymongo.MongoClient = mongomock.MongoClient
+
+    # imported only now so that they pick up the environment above
+    import database
+    import news
+    import app as webapp
+
+    database.DB_client.drop_database(args.db)
+    random.seed(args.seed)
+    t0 = time.perf_counter()
+    keywords = seed(database, SCALES[args.scale])
+    print(f"Seeded {SCALES[args.scale]} updates in {time.perf_counter() - t0:.1f}s")
+    if args.mongo_uri:
+        from indexes import ensure_indexes
+        ensure_indexes(database.db)
+
+    client = webapp.app.test_client()
+    results = []
+
+    results.append(measure("search_by_keyword", lambda i: news.search_by_keyword(random.choice(keywords)), args.runs))
+    if args.mongo_uri:  # mongomock has no $text
+        results.append(measure("text_search", lambda i: news.text_search(random.choice(WORDS)), args.runs))
+
+    results.append(measure("/api/news page 1", lambda i: client.get("/api/news?group=Home"), args.runs))
+    results.append(measure(
+        "/api/news group page 1",
+        lambda i: client.get(f"/api/news?group={random.choice(GROUPS)}"),
+        args.runs
+    ))
+
+    # keep scrolling: every call fetches the page after the previous one
+    state = {"cursor": None}
+
+    def next_page(i):
+        url = "/api/news?group=Home" + (f"&cursor={state['cursor']}" if state["cursor"] else "")
+        state["cursor"] = client.get(url).get_json()["next_cursor"]
+
+    results.append(measure("/api/news deep scroll", next_page, args.runs, warmup=0))
+
+    results.append(measure("new_topic", lambda i: news.new_topic(f"bench topic {i}"), args.ai_runs, warmup=0))
+
+    topic_ids = [t["_id"] for t in database.topics.find({}, {"_id": 1}).limit(args.refresh_topics)]
+    t0 = time.perf_counter()
+    summary = news.refresh_topics(topic_ids)
+    wall = time.perf_counter() - t0
+    results.append({
+        "name": f"full_update ({len(topic_ids)} topics)",
+        "runs": 1,
+        "p50_ms": round(wall * 1000, 2),
+        "p99_ms": round(wall * 1000, 2),
+        "throughput": round(len(topic_ids) / wall, 1) if wall else 0.0,
+        "summary": {k: v for k, v in summary.items() if k != "errors"}
+    })
+
+    server.shutdown()
+
+    print(f"\n{'benchmark':<32}{'runs':>6}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for r in results:
+        print(f"{r['name']:<32}{r['runs']:>6}{r['p50_ms']:>10}{r['p99_ms']:>10}{r['throughput']:>10}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scale": args.scale, "mongo": "mongod" if args.mongo_uri else "mongomock", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from db_timing import command_listener
+
+# Load environment variables
+load_dotenv()
+
+# One client per process, shared by news, users and the maintenance scripts
+# The listener only measures while a request is being profiled (see profiling.py and db_timing.py)
+DB_client = MongoClient(
+    os.getenv("MONGO_URI", "mongodb://localhost:27017/"),
+    event_listeners=[command_listener]
+)
+
+# Collections
+db = DB_client[os.getenv("MONGO_DB", "News")]
+topics = db["Topics"]
+topic_updates = db["Topic_updates"]
+voting = db["Voting"]
+voting_rounds = db["Voting_rounds"]  # the current round number, see news.run_weekly_winners
+users = db["Users"]
+llm_cache = db["LLM_cache"]
+drafts = db["Drafts"]  # articles while they are being streamed in
+jobs = db["Jobs"]  # background work queue, see jobs.py
+feed_cards = db["Feed_cards"]  # body-less copies of Topic_updates for feed pages
+feed_revisions = db["Feed_revisions"]  # bumped when existing feed cards are rewritten, see page_cache.py
+metrics_store = db["Metrics"]  # last metrics of every process, see metrics.MetricsPublisher
+
+
+def utcnow():
+    # timestamps are stored as native BSON dates in UTC, to the second
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def feed_card(update):
+    # what a feed page shows of an update, under the update's own _id
+    return {
+        "_id": update["_id"],
+        "topic_id": update["topic_id"],
+        "group": update["group"],
+        "headline": update["name"],
+        "summary": update["summary"],
+        "update_time": update["update_time"]
+    }
@@ -0,0 +1,33 @@
+# db_timing.py
+# MongoDB command timing for request profiling. Kept free of Flask so that
+# database.py, and with it jobs.py, scheduler.py and the maintenance scripts,
+# can install the listener without importing the web stack; the Flask hooks
+# that start and report a measurement live in profiling.py.
+import threading
+from pymongo import monitoring
+
+# Per-thread state of the request being profiled; stats is None when nothing is measured
+request_local = threading.local()
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Counts commands and their server time for the request running on this thread."""
+
+    def _finish(self, event):
+        stats = getattr(request_local, "stats", None)
+        if stats is not None:
+            stats["db_calls"] += 1
+            stats["db_seconds"] += event.duration_micros / 1e6
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+# Passed to MongoClient(event_listeners=...) in database.py
+command_listener = MongoCommandTimer()
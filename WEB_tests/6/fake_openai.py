@@ -0,0 +1,185 @@
+# fake_openai.py
+# Local stand-in for the OpenAI chat completions API, for benchmarks and offline runs.
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GROUPS = [
+    "Politics_Conflicts", "Economy_Business", "Science_Technology",
+    "Environment_Climate", "Sports", "Culture_Society"
+]
+WORDS = (
+    "government market climate research league festival talks growth energy "
+    "election court vaccine satellite storm museum trade summit reform team"
+).split()
+
+
+class FakeConfig:
+    """Knobs shared by all request handlers of one server."""
+
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency            # mean seconds per response
+        self.jitter = jitter              # +/- seconds around the mean
+        self.error_rate = error_rate      # share of requests answered with 500
+        self.rate_limit_rate = rate_limit_rate  # share answered with 429
+        self.retry_after = retry_after    # Retry-After header sent with 429
+        # latencies, failures and replies; seeded runs draw the same sequence (in request order)
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def _sentence(n=12, rng=random):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def fake_article(rng=random):
+    paragraphs = [" ".join(_sentence(rng=rng) for _ in range(4)) for _ in range(4)]
+    return (
+        f"{rng.choice(GROUPS)}\n\n"
+        f"{_sentence(8, rng)[:-1]}\n\n"
+        f"{_sentence(25, rng)}\n\n"
+        + "\n\n".join(paragraphs)
+        + "\n\n\n- Reuters\n- Associated Press"
+    )
+
+
+def fake_article_json(rng=random):
+    # what a structured-output (json_schema) article request gets back
+    return json.dumps({
+        "group": rng.choice(GROUPS),
+        "headline": _sentence(8, rng)[:-1],
+        "summary": _sentence(25, rng),
+        "body": "\n\n".join(" ".join(_sentence(rng=rng) for _ in range(4)) for _ in range(4)),
+        "sources": ["Reuters", "Associated Press"]
+    })
+
+
+def fake_reply(messages, response_format=None, rng=random):
+    """Answer in the shape each prompt in articles.py and news.py expects."""
+    if (response_format or {}).get("type") == "json_schema":
+        return fake_article_json(rng)
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user = next((m["content"] for m in messages if m["role"] == "user"), "")
+    if "JSON array" in system:
+        count = len(re.findall(r"^\d+\. ", user, flags=re.MULTILINE))
+        return json.dumps([round(rng.random(), 2) for _ in range(count)])
+    if "Return only a number" in system:
+        return f"{rng.random():.2f}"
+    return fake_article(rng)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    config = FakeConfig()
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        config = self.config
+        with config.lock:
+            config.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        with config.lock:
+            delay = config.latency + config.random.uniform(-config.jitter, config.jitter)
+            roll = config.random.random()
+        time.sleep(max(0.0, delay))
+
+        if roll < config.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                            {"Retry-After": str(config.retry_after)})
+            return
+        if roll < config.rate_limit_rate + config.error_rate:
+            self._send_json(500, {"error": {"message": "Internal error", "type": "server_error"}})
+            return
+
+        with config.lock:
+            content = fake_reply(request.get("messages", []), request.get("response_format"), config.random)
+            reply_id = f"chatcmpl-fake{config.random.getrandbits(32):x}"
+        prompt_tokens = sum(len(m.get("content") or "") for m in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+        if request.get("stream"):
+            self._send_stream(request.get("model", "gpt-4o"), content, usage, reply_id)
+            return
+        self._send_json(200, {
+            "id": reply_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _send_stream(self, model, content, usage, reply_id, piece=16):
+        # server-sent events in the chat.completion.chunk format, a few characters at a time
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        base = {"id": reply_id, "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model}
+        for i in range(0, len(content), piece):
+            chunk = {**base, "choices": [{"index": 0, "delta": {"content": content[i:i + piece]}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.config.latency / 50)
+        self.wfile.write(f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_fake_server(port=0, **config):
+    """Serve in a background thread. Returns (server, base_url); stop with server.shutdown()."""
+    handler = type("ConfiguredHandler", (FakeOpenAIHandler,), {"config": FakeConfig(**config)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, help="repeat the same latencies, failures and replies")
+    args = parser.parse_args()
+
+    server, url = start_fake_server(
+        args.port, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed
+    )
+    print(f"Fake OpenAI listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
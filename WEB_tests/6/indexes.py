@@ -0,0 +1,130 @@
+# indexes.py
+import sys
+import json
+import logging
+import argparse
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import PyMongoError
+from database import db
+
+# Every index the app relies on, per collection: (keys, options).
+# Names are explicit so that re-running is a no-op and reports are readable.
+INDEXES = {
+    "Topics": [
+        ([("keywords", ASCENDING)], {"name": "keywords"}),
+        # refresh scheduler: topics due next
+        ([("next_due", ASCENDING)], {"name": "next_due"}),
+    ],
+    "Topic_updates": [
+        # latest update of a topic, keyword search ($in + merged sort)
+        ([("topic_id", ASCENDING), ("update_time", DESCENDING), ("_id", DESCENDING)],
+         {"name": "topic_id_update_time"}),
+        # newest-first listings (prefix-only text search)
+        ([("update_time", DESCENDING), ("_id", DESCENDING)], {"name": "update_time"}),
+        ([("group", ASCENDING), ("update_time", DESCENDING), ("_id", DESCENDING)],
+         {"name": "group_update_time"}),
+        # prefix* search terms: anchored regexes on the words of headline, summary and body
+        ([("search_tokens", ASCENDING)], {"name": "search_tokens"}),
+        # full-text search, headline matches count most
+        ([("name", TEXT), ("summary", TEXT), ("text", TEXT)],
+         {"name": "text_search", "weights": {"name": 10, "summary": 5, "text": 1}, "default_language": "english"}),
+    ],
+    "Feed_cards": [
+        # home feed
+        ([("update_time", DESCENDING), ("_id", DESCENDING)], {"name": "update_time"}),
+        # group feeds
+        ([("group", ASCENDING), ("update_time", DESCENDING), ("_id", DESCENDING)],
+         {"name": "group_update_time"}),
+    ],
+    "Voting": [
+        # leaderboard pages and the weekly top K of a round; _id breaks ties so pages are stable
+        ([("round", ASCENDING), ("votes", DESCENDING), ("_id", DESCENDING)], {"name": "round_votes_id"}),
+    ],
+    "Users": [
+        ([("username", ASCENDING)], {"name": "username_unique", "unique": True}),
+    ],
+    "Drafts": [
+        # drafts are only interesting while (or shortly after) they stream in
+        ([("started_at", ASCENDING)], {"name": "started_at_ttl", "expireAfterSeconds": 24 * 3600}),
+    ],
+    "Jobs": [
+        # at most one queued/running job per dedupe key; finished jobs drop the key
+        ([("active_key", ASCENDING)],
+         {"name": "active_key_unique", "unique": True, "partialFilterExpression": {"active_key": {"$exists": True}}}),
+        # workers claim the oldest claimable job
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {"name": "status_created_at"}),
+    ],
+    "Metrics": [
+        # a process that stopped publishing drops out of /metrics after a day
+        ([("updated_at", ASCENDING)], {"name": "updated_at_ttl", "expireAfterSeconds": 24 * 3600}),
+    ],
+    "LLM_cache": [
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0}),
+    ],
+}
+
+
+def ensure_indexes(database=db, collections=None) -> dict:
+    """
+    Create every declared index that does not exist yet. Safe to run repeatedly.
+    Returns {"created": [...], "existing": [...], "failed": [...]} as "Collection.index" names.
+    A failure (e.g. duplicate usernames blocking the unique index) is logged, not raised.
+    """
+    result = {"created": [], "existing": [], "failed": []}
+    for name, specs in INDEXES.items():
+        if collections and name not in collections:
+            continue
+        collection = database[name]
+        existing = collection.index_information()
+        for keys, options in specs:
+            label = f"{name}.{options['name']}"
+            if options["name"] in existing:
+                result["existing"].append(label)
+                continue
+            try:
+                collection.create_index(keys, **options)
+            except PyMongoError as e:
+                logging.warning("Could not create index %s: %s", label, e)
+                result["failed"].append(label)
+                continue
+            logging.info("Created index %s", label)
+            result["created"].append(label)
+    return result
+
+
+def index_report(database=db) -> dict:
+    """
+    Compare declared indexes with what the server has, using $indexStats.
+    missing: declared but not built; unused: built but never used since the
+    server started; undeclared: built but not in INDEXES.
+    """
+    report = {"missing": [], "unused": [], "undeclared": [], "usage": {}}
+    for name, specs in INDEXES.items():
+        collection = database[name]
+        declared = {options["name"] for _, options in specs}
+        stats = {s["name"]: s["accesses"]["ops"] for s in collection.aggregate([{"$indexStats": {}}])}
+        for index_name in sorted(declared - stats.keys()):
+            report["missing"].append(f"{name}.{index_name}")
+        for index_name, ops in stats.items():
+            label = f"{name}.{index_name}"
+            report["usage"][label] = ops
+            if index_name == "_id_":
+                continue
+            if index_name not in declared:
+                report["undeclared"].append(label)
+            if ops == 0:
+                report["unused"].append(label)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and check MongoDB indexes")
+    parser.add_argument("--report", action="store_true", help="only report missing/unused indexes")
+    args = parser.parse_args()
+
+    if args.report:
+        print(json.dumps(index_report(), indent=2))
+    else:
+        outcome = ensure_indexes()
+        print(json.dumps(outcome, indent=2))
+        sys.exit(1 if outcome["failed"] else 0)
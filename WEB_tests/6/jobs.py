@@ -0,0 +1,173 @@
+# jobs.py
+# MongoDB-backed job queue for work that is too slow for a web request.
+#   enqueue from the app:   job_id, created = enqueue("full_update")
+#   run workers:            python jobs.py worker --processes 2
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import jobs, metrics_store, utcnow
+from metrics import MetricsPublisher
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))  # a silent worker loses its job after this
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2.0  # seconds between polls of an empty queue
+
+# kind -> callable(**params) returning a JSON-serializable result
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+@handler("full_update")
+def _full_update(**params):
+    from news import full_update
+    return full_update(**params)
+
+
+@handler("weekly_winners")
+def _weekly_winners(**params):
+    from news import run_weekly_winners
+    return run_weekly_winners(**params)
+
+
+# --- Producer side ---
+def enqueue(kind, params=None):
+    """
+    Queue a job and return (job_id, created). An identical job (same kind and
+    params) that is still queued or running is reused instead: created is False.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    params = params or {}
+    key = f"{kind}:{json.dumps(params, sort_keys=True)}"
+    for _ in range(3):
+        try:
+            return jobs.insert_one({
+                "kind": kind,
+                "params": params,
+                "status": "queued",
+                "active_key": key,
+                "attempts": 0,
+                "created_at": utcnow()
+            }).inserted_id, True
+        except DuplicateKeyError:
+            existing = jobs.find_one({"active_key": key}, {"_id": 1})
+            if existing:
+                return existing["_id"], False
+            # the duplicate finished in between, try again
+    raise RuntimeError(f"Could not enqueue {kind}")
+
+
+def get_job(job_id):
+    return jobs.find_one({"_id": job_id}, {"active_key": 0})
+
+
+# --- Worker side ---
+def claim(worker_id):
+    """Atomically take the oldest queued job, or a running one whose worker went silent."""
+    now = utcnow()
+    return jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_until": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker_id,
+                "started_at": now,
+                "lease_until": now + timedelta(seconds=LEASE_SECONDS)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _finish(job, status, **fields):
+    jobs.update_one(
+        {"_id": job["_id"], "worker": job["worker"]},
+        {"$set": {"status": status, "finished_at": utcnow(), **fields}, "$unset": {"active_key": "", "lease_until": ""}}
+    )
+
+
+def _keep_lease(job, stop):
+    # heartbeat: long jobs (a full refresh) outlive a single lease
+    while not stop.wait(LEASE_SECONDS / 3):
+        jobs.update_one(
+            {"_id": job["_id"], "worker": job["worker"]},
+            {"$set": {"lease_until": utcnow() + timedelta(seconds=LEASE_SECONDS)}}
+        )
+
+
+def run_job(job):
+    if job["attempts"] > MAX_ATTEMPTS:
+        _finish(job, "failed", error="gave up after repeated worker losses")
+        return
+    fn = HANDLERS.get(job["kind"])
+    if fn is None:
+        _finish(job, "failed", error=f"unknown job kind {job['kind']!r}")
+        return
+
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(job, stop), daemon=True).start()
+    started = time.perf_counter()
+    try:
+        result = fn(**job.get("params", {}))
+    except Exception as e:
+        logging.exception("Job %s (%s) failed", job["_id"], job["kind"])
+        _finish(job, "failed", error=str(e), duration=round(time.perf_counter() - started, 3))
+    else:
+        _finish(job, "done", result=result, duration=round(time.perf_counter() - started, 3))
+    finally:
+        stop.set()
+
+
+def worker_loop(worker_id=None):
+    from news import AI_client
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    # the LLM calls of the jobs show up in the web app's /metrics and /api/ai_stats
+    MetricsPublisher(metrics_store, "jobs", extra=AI_client.stats).start()
+    logging.info("Job worker %s started", worker_id)
+    while True:
+        job = claim(worker_id)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        logging.info("Worker %s running job %s (%s)", worker_id, job["_id"], job["kind"])
+        run_job(job)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background job workers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_worker = sub.add_parser("worker", help="run job workers until interrupted")
+    p_worker.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        worker_loop()
+    else:
+        # the workers split this process's share of the OpenAI quota (see ai_client.QUOTA_SHARE)
+        os.environ["OPENAI_QUOTA_SHARE"] = str(float(os.getenv("OPENAI_QUOTA_SHARE", "1")) / args.processes)
+        # spawn, not fork: every worker needs its own MongoClient
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=worker_loop, daemon=True) for _ in range(args.processes)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
@@ -0,0 +1,107 @@
+# llm_cache.py
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import PyMongoError
+
+# ---- Configurable limits ----
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "21600"))  # seconds; 0 disables caching
+CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))  # in-process entries
+
+
+def make_key(request: dict) -> str:
+    """Content address of a completion request: sha256 over model, messages and parameters."""
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for completion texts.
+    Tier 1 is an in-process LRU bounded to max_entries; tier 2 is an optional
+    MongoDB collection shared by every process. Both honour the same TTL,
+    Mongo documents are removed by the TTL index declared in indexes.py.
+    """
+
+    def __init__(self, collection=None, ttl=CACHE_TTL, max_entries=CACHE_SIZE):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at monotonic, value)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "memory_hits": 0, "mongo_hits": 0, "misses": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _count(self, *names):
+        with self._lock:
+            for name in names:
+                self.counters[name] += 1
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+            except PyMongoError as e:
+                logging.warning("LLM cache lookup failed: %s", e)
+                doc = None
+            if doc:
+                expires_at = doc["expires_at"].replace(tzinfo=timezone.utc)
+                remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+                self._remember(key, doc["value"], now + remaining)
+                self._count("hits", "mongo_hits")
+                return doc["value"]
+
+        self._count("misses")
+        return None
+
+    def set(self, key, value, model=None):
+        self._remember(key, value, time.monotonic() + self.ttl)
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one(
+                {"_id": key},
+                {
+                    "value": value,
+                    "model": model,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+                },
+                upsert=True
+            )
+        except PyMongoError as e:
+            logging.warning("LLM cache write failed: %s", e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self.counters)
+            out["entries"] = len(self._entries)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 3) if lookups else 0.0
+        return out
@@ -0,0 +1,219 @@
+# metrics.py
+# Process-wide counters and latency histograms for LLM calls.
+# Exported as Prometheus text (/metrics) and as plain dicts for per-run JSON reports.
+# Job workers and the scheduler push theirs to a shared collection (MetricsPublisher),
+# so the web app's /metrics reports every process.
+import os
+import math
+import time
+import atexit
+import socket
+import logging
+import threading
+from datetime import datetime, timezone
+from pymongo.errors import PyMongoError
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, math.inf)  # seconds
+METRICS_PUSH_INTERVAL = float(os.getenv("METRICS_PUSH_INTERVAL", "15"))  # seconds between pushes
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in labels.items())
+
+
+class Metrics:
+    """
+    calls: per (site, model) latency histogram, outcomes, retries and tokens.
+    counters: free-form named counters with labels, e.g. parse failures.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+        self.counters = {}
+
+    def _call(self, site, model):
+        key = (site, model)
+        if key not in self.calls:
+            self.calls[key] = {
+                "buckets": [0] * len(LATENCY_BUCKETS),
+                "seconds": 0.0,
+                "ok": 0,
+                "error": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+        return self.calls[key]
+
+    def observe_call(self, site, model, seconds, usage=None, retries=0, failed=False):
+        with self._lock:
+            call = self._call(site, model)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    call["buckets"][i] += 1
+                    break
+            call["seconds"] += seconds
+            call["error" if failed else "ok"] += 1
+            call["retries"] += retries
+            if usage is not None:
+                call["prompt_tokens"] += usage.prompt_tokens
+                call["completion_tokens"] += usage.completion_tokens
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        """JSON-friendly copy: {"calls": {"site/model": {...}}, "counters": {"name{labels}": n}}."""
+        with self._lock:
+            calls = {
+                f"{site}/{model}": {
+                    "calls": c["ok"] + c["error"],
+                    "errors": c["error"],
+                    "retries": c["retries"],
+                    "seconds": round(c["seconds"], 3),
+                    "prompt_tokens": c["prompt_tokens"],
+                    "completion_tokens": c["completion_tokens"],
+                }
+                for (site, model), c in self.calls.items()
+            }
+            counters = {f"{name}{{{_labels(**dict(labels))}}}": n for (name, labels), n in self.counters.items()}
+        return {"calls": calls, "counters": counters}
+
+    def state(self) -> dict:
+        """Complete copy, histograms included, in a shape MongoDB can store (see MetricsPublisher)."""
+        with self._lock:
+            return {
+                "calls": [
+                    {"site": site, "model": model, **c, "buckets": list(c["buckets"])}
+                    for (site, model), c in self.calls.items()
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": n}
+                    for (name, labels), n in self.counters.items()
+                ]
+            }
+
+    def merge(self, state):
+        """Add a state() taken in another process to this registry."""
+        with self._lock:
+            for c in state["calls"]:
+                call = self._call(c["site"], c["model"])
+                call["buckets"] = [a + b for a, b in zip(call["buckets"], c["buckets"])]
+                for field in ("seconds", "ok", "error", "retries", "prompt_tokens", "completion_tokens"):
+                    call[field] += c[field]
+            for c in state["counters"]:
+                key = (c["name"], tuple(sorted(c["labels"].items())))
+                self.counters[key] = self.counters.get(key, 0) + c["value"]
+
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP llm_call_seconds LLM completion latency, including throttling and retries",
+            "# TYPE llm_call_seconds histogram",
+        ]
+        with self._lock:
+            calls = {key: {**c, "buckets": list(c["buckets"])} for key, c in self.calls.items()}
+            counters = dict(self.counters)
+        for (site, model), c in calls.items():
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, c["buckets"]):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else bound
+                lines.append(f'llm_call_seconds_bucket{{{_labels(site=site, model=model, le=le)}}} {cumulative}')
+            lines.append(f"llm_call_seconds_sum{{{_labels(site=site, model=model)}}} {c['seconds']:.3f}")
+            lines.append(f"llm_call_seconds_count{{{_labels(site=site, model=model)}}} {c['ok'] + c['error']}")
+
+        lines += ["# HELP llm_calls_total LLM completion calls by outcome", "# TYPE llm_calls_total counter"]
+        for (site, model), c in calls.items():
+            for outcome in ("ok", "error"):
+                lines.append(f"llm_calls_total{{{_labels(site=site, model=model, outcome=outcome)}}} {c[outcome]}")
+        lines += ["# HELP llm_retries_total Retried LLM requests", "# TYPE llm_retries_total counter"]
+        for (site, model), c in calls.items():
+            lines.append(f"llm_retries_total{{{_labels(site=site, model=model)}}} {c['retries']}")
+        lines += ["# HELP llm_tokens_total Tokens reported by response.usage", "# TYPE llm_tokens_total counter"]
+        for (site, model), c in calls.items():
+            for kind in ("prompt", "completion"):
+                lines.append(f"llm_tokens_total{{{_labels(site=site, model=model, kind=kind)}}} {c[kind + '_tokens']}")
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), n in counters.items():
+                if counter_name == name:
+                    lines.append(f"{name}{{{_labels(**dict(labels))}}} {n}")
+        return "\n".join(lines) + "\n"
+
+
+def diff(before: dict, after: dict) -> dict:
+    """after - before for two snapshots, dropping entries that did not change (per-run reports)."""
+    out = {}
+    for key, value in after.items():
+        if isinstance(value, dict):
+            changed = diff(before.get(key, {}), value)
+            if changed:
+                out[key] = changed
+        else:
+            delta = value - before.get(key, 0)
+            if delta:
+                out[key] = round(delta, 3) if isinstance(delta, float) else delta
+    return out
+
+
+# Shared by every module of the process
+metrics = Metrics()
+
+
+# --- Sharing between processes ---
+def process_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class MetricsPublisher:
+    """
+    Writes this process's metrics, plus optional extra stats (e.g. the OpenAI
+    client's counters), to a shared collection every interval seconds and at
+    exit. One document per process; the TTL index in indexes.py removes the
+    documents of processes that are gone.
+    """
+
+    def __init__(self, collection, role, extra=None, interval=METRICS_PUSH_INTERVAL):
+        self.collection = collection
+        self.role = role
+        self.extra = extra
+        self.interval = interval
+
+    def push(self):
+        try:
+            self.collection.replace_one({"_id": process_id()}, {
+                "role": self.role,
+                "updated_at": datetime.now(timezone.utc),
+                "metrics": metrics.state(),
+                "extra": self.extra() if self.extra else None
+            }, upsert=True)
+        except PyMongoError as e:
+            logging.warning("Could not publish metrics: %s", e)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.push()
+
+    def start(self):
+        threading.Thread(target=self._run, name="metrics-publish", daemon=True).start()
+        atexit.register(self.push)
+        return self
+
+
+def published(collection) -> list:
+    """The last push of every other process."""
+    return list(collection.find({"_id": {"$ne": process_id()}}))
+
+
+def combined(collection) -> Metrics:
+    """This process's live metrics plus the last push of every other process."""
+    total = Metrics()
+    total.merge(metrics.state())
+    for doc in published(collection):
+        total.merge(doc["metrics"])
+    return total
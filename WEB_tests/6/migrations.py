@@ -0,0 +1,222 @@
+# migrations.py
+# One-off data migrations for databases created before the matching changes.
+# Run them in this order, each until it reports nothing left to do:
+#   python migrations.py datetimes      # string timestamps -> UTC datetimes
+#   python migrations.py feed-cards     # the feed reads Topic_updates until this has run
+#   python migrations.py search-tokens  # prefix* searches match nothing on older updates until then
+# "resanitize" can run at any time after those.
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from pymongo import UpdateOne, ReplaceOne
+from database import db, feed_card
+from security import UPDATE_FIELD_LIMITS, sanitize_many
+from queries import search_tokens
+from page_cache import bump_revisions
+
+# Migration progress lives here, one document per migration step
+migrations = db["Migrations"]
+
+# Legacy string timestamps written by datetime.now().strftime(...)
+LEGACY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# (collection, field) pairs that used to hold string timestamps
+TIMESTAMP_FIELDS = [
+    ("Topic_updates", "update_time"),
+    ("Voting", "created_at"),
+]
+
+
+def _checkpoint(step: str) -> dict:
+    return migrations.find_one({"_id": step}) or {"_id": step, "last_id": None, "converted": 0, "skipped": 0}
+
+
+def _save_checkpoint(state: dict) -> None:
+    migrations.replace_one({"_id": state["_id"]}, state, upsert=True)
+
+
+def _to_utc(value: str, source_tz) -> datetime:
+    naive = datetime.strptime(value, LEGACY_TIME_FORMAT)
+    # source_tz None means "the timezone of this machine", which is what datetime.now() used
+    local = naive.replace(tzinfo=source_tz) if source_tz else naive.astimezone()
+    return local.astimezone(timezone.utc)
+
+
+def backfill_datetimes(batch_size=1000, source_tz=None) -> dict:
+    """
+    Convert legacy string timestamps to native UTC datetimes.
+    Documents are walked in _id order in chunks of batch_size and written with
+    one bulk_write per chunk. The last processed _id is checkpointed in the
+    Migrations collection, so an interrupted run continues where it stopped.
+    Values that do not parse are left alone and counted as skipped.
+    """
+    summary = {}
+    for collection_name, field in TIMESTAMP_FIELDS:
+        collection = db[collection_name]
+        state = _checkpoint(f"datetimes:{collection_name}.{field}")
+        while True:
+            query = {field: {"$type": "string"}}
+            if state["last_id"] is not None:
+                query["_id"] = {"$gt": state["last_id"]}
+            batch = list(collection.find(query, {field: 1}).sort("_id", 1).limit(batch_size))
+            if not batch:
+                break
+
+            ops = []
+            for doc in batch:
+                try:
+                    ops.append(UpdateOne(
+                        {"_id": doc["_id"], field: doc[field]},
+                        {"$set": {field: _to_utc(doc[field], source_tz)}}
+                    ))
+                except ValueError:
+                    logging.warning("Skipping unparseable %s.%s on %s: %r", collection_name, field, doc["_id"], doc[field])
+                    state["skipped"] += 1
+            if ops:
+                state["converted"] += collection.bulk_write(ops, ordered=False).modified_count
+
+            state["last_id"] = batch[-1]["_id"]
+            _save_checkpoint(state)
+            logging.info("%s.%s: %d converted so far", collection_name, field, state["converted"])
+
+        summary[f"{collection_name}.{field}"] = {"converted": state["converted"], "skipped": state["skipped"]}
+    return summary
+
+
+def backfill_feed_cards(batch_size=1000) -> dict:
+    """
+    Write a Feed_cards document for every existing Topic_update (run after
+    "datetimes", so that cards get native dates). Same chunking and
+    checkpointing as backfill_datetimes; re-running only upserts cards again.
+    """
+    source = db["Topic_updates"]
+    cards = db["Feed_cards"]
+    state = _checkpoint("feed_cards")
+    fields = {"topic_id": 1, "group": 1, "name": 1, "summary": 1, "update_time": 1}
+    while True:
+        query = {"_id": {"$gt": state["last_id"]}} if state["last_id"] is not None else {}
+        batch = list(source.find(query, fields).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        ops = [ReplaceOne({"_id": doc["_id"]}, feed_card(doc), upsert=True) for doc in batch]
+        result = cards.bulk_write(ops, ordered=False)
+        state["converted"] += result.upserted_count + result.modified_count
+        state["last_id"] = batch[-1]["_id"]
+        _save_checkpoint(state)
+        logging.info("Feed_cards: %d written so far", state["converted"])
+    return {"Feed_cards": {"written": state["converted"]}}
+
+
+def backfill_search_tokens(batch_size=1000) -> dict:
+    """
+    Store the search_tokens of every existing Topic_update, which prefix*
+    searches need (see queries.search_tokens). Same chunking and
+    checkpointing as backfill_datetimes; re-running only rewrites them.
+    """
+    source = db["Topic_updates"]
+    state = _checkpoint("search_tokens")
+    fields = {"name": 1, "summary": 1, "text": 1}
+    while True:
+        query = {"_id": {"$gt": state["last_id"]}} if state["last_id"] is not None else {}
+        batch = list(source.find(query, fields).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        ops = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"search_tokens": search_tokens(
+                doc.get("name") or "", doc.get("summary") or "", doc.get("text") or ""
+            )}})
+            for doc in batch
+        ]
+        state["converted"] += source.bulk_write(ops, ordered=False).modified_count
+        state["last_id"] = batch[-1]["_id"]
+        _save_checkpoint(state)
+        logging.info("Topic_updates: %d search token lists written so far", state["converted"])
+    return {"Topic_updates": {"search_tokens": state["converted"]}}
+
+
+def resanitize_updates(batch_size=1000, processes=1) -> dict:
+    """
+    Run every Topic_update through the current AI-output sanitizer (see
+    security.sanitize_many, spread over `processes` worker processes) and
+    rewrite only the documents that change, with their feed cards, one
+    bulk_write per batch_size documents. Rewritten updates get their rev
+    bumped, which changes their article ETag (page_cache.article_etag), and
+    the feeds showing rewritten cards get a new revision, which changes
+    their feed ETags (page_cache.bump_revisions). Checkpointed like the other steps;
+    after changing the rules, delete the "resanitize" entry in Migrations to start over.
+    """
+    source = db["Topic_updates"]
+    cards = db["Feed_cards"]
+    state = _checkpoint("resanitize")
+    query = {"_id": {"$gt": state["last_id"]}} if state["last_id"] is not None else {}
+    docs = source.find(query, {field: 1 for field in UPDATE_FIELD_LIMITS}).sort("_id", 1)
+
+    def write(update_ops, card_ops, card_groups, pending, last_id):
+        if update_ops:
+            state["converted"] += source.bulk_write(update_ops, ordered=False).modified_count
+        if card_ops:
+            cards.bulk_write(card_ops, ordered=False)
+            bump_revisions(card_groups)
+        state["skipped"] += pending - len(update_ops)
+        state["last_id"] = last_id
+        _save_checkpoint(state)
+        logging.info("Topic_updates: %d re-sanitized so far", state["converted"])
+
+    update_ops, card_ops, card_groups, pending, last_id = [], [], set(), 0, None
+    for doc, clean in sanitize_many(docs, processes=processes):
+        changed = {field: value for field, value in clean.items() if field != "_id" and doc.get(field) != value}
+        if changed.keys() & {"name", "summary", "text"}:
+            changed["search_tokens"] = search_tokens(*(clean.get(f) or "" for f in ("name", "summary", "text")))
+        if changed:
+            update_ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": changed, "$inc": {"rev": 1}}))
+            card_fields = {
+                "headline" if f == "name" else f: v
+                for f, v in changed.items() if f not in ("text", "search_tokens")
+            }
+            if card_fields:
+                card_ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": card_fields}))
+                # the card leaves its old group's feed when the group changes
+                card_groups.update({doc.get("group"), clean.get("group")} - {None})
+        pending += 1
+        last_id = doc["_id"]
+        if pending == batch_size:
+            write(update_ops, card_ops, card_groups, pending, last_id)
+            update_ops, card_ops, card_groups, pending = [], [], set(), 0
+    if pending:
+        write(update_ops, card_ops, card_groups, pending, last_id)
+    return {"Topic_updates": {"changed": state["converted"], "unchanged": state["skipped"]}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="One-off data migrations",
+        epilog="On an existing database run datetimes, then feed-cards, then search-tokens."
+    )
+    sub = parser.add_subparsers(dest="step", required=True)
+
+    p_dates = sub.add_parser("datetimes", help="convert string timestamps to UTC datetimes")
+    p_dates.add_argument("--batch-size", type=int, default=1000)
+    p_dates.add_argument("--source-tz", help="IANA zone the strings were written in (default: this machine's)")
+
+    p_cards = sub.add_parser("feed-cards", help="create the compact feed cards of existing updates")
+    p_cards.add_argument("--batch-size", type=int, default=1000)
+
+    p_clean = sub.add_parser("resanitize", help="re-run the AI-output sanitizer over every update")
+    p_clean.add_argument("--batch-size", type=int, default=1000)
+    p_clean.add_argument("--processes", type=int, default=1, help="sanitizer worker processes")
+
+    p_tokens = sub.add_parser("search-tokens", help="store the words of existing updates for prefix searches")
+    p_tokens.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.step == "datetimes":
+        tz = ZoneInfo(args.source_tz) if args.source_tz else None
+        print(json.dumps(backfill_datetimes(args.batch_size, tz), indent=2))
+    elif args.step == "feed-cards":
+        print(json.dumps(backfill_feed_cards(args.batch_size), indent=2))
+    elif args.step == "resanitize":
+        print(json.dumps(resanitize_updates(args.batch_size, args.processes), indent=2))
+    elif args.step == "search-tokens":
+        print(json.dumps(backfill_search_tokens(args.batch_size), indent=2))
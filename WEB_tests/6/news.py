@@ -1,48 +1,234 @@
 import os
+import json
+import time
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import openai
-from pymongo import MongoClient
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import timedelta
+from database import (
+    topics,
+    topic_updates,
+    voting,
+    voting_rounds,
+    llm_cache,
+    drafts,
+    feed_cards,
+    feed_card,
+    utcnow,
+    DB_client
+)
+from users import use_token, refund_token, reset_all_tokens
+from ai_client import RateLimitedClient
+from llm_cache import ResponseCache
+from metrics import metrics, diff as metrics_diff
+from page_cache import page_cache
+from votes import vote_buffer, VOTE_SETTLE_SECONDS
 from security import (
     validate_topic_list,
     validate_keyword,
+    validate_search_query,
     sanitize_ai_output
 )
+from articles import (
+    ARTICLE_MODEL,
+    article_messages,
+    article_request,
+    parse_article,
+    parse_failure,
+    valid_group
+)
+from queries import (
+    SEARCH_PAGE_SIZE,
+    SEARCH_FIELDS,
+    FEED_FIELDS,
+    UPDATE_FEED_FIELDS,
+    NEWEST_FIRST,
+    split_page,
+    score_page,
+    feed_query,
+    update_cards,
+    keyword_query,
+    keyword_results,
+    search_tokens,
+    text_query,
+    text_results
+)
 
 
 # Load environment variables
 load_dotenv()
 
-AI_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-DB_client = MongoClient("mongodb://localhost:27017/")
+# Retries are handled by the wrapper; OPENAI_BASE_URL can point at a local fake server.
+# Only scoring replies are cached: articles are always generated anew (cached=False)
+AI_client = RateLimitedClient(
+    openai.OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL") or None,
+        max_retries=0
+    ),
+    cache=ResponseCache(llm_cache)
+)
 
-# Collections
-db = DB_client["News"]
-topics = db["Topics"]
-topic_updates = db["Topic_updates"]
-voting = db["Voting"]  # NEW: separate voting collection
+# Refresh settings
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "8"))  # max concurrent topic refreshes
+RELEVANCE_THRESHOLD = 0.5  # topics scoring at or below this get regenerated
+SCORE_BATCH_SIZE = int(os.getenv("SCORE_BATCH_SIZE", "20"))  # summaries scored per completion
+VOTING_TRANSACTIONS = os.getenv("VOTING_TRANSACTIONS", "0") == "1"  # needs a replica set
+VOTING_PAGE_SIZE = 20
+VOTES_ORDER = [("votes", -1), ("_id", -1)]  # the leaderboard of a round, backed by the round_votes_id index
+
+# Scheduling: when a topic is due again after a refresh (see scheduler.py)
+REFRESH_BASE_INTERVAL = timedelta(hours=24)
+REFRESH_MIN_INTERVAL = timedelta(hours=1)
+REFRESH_MAX_INTERVAL = timedelta(days=7)
+REFRESH_RETRY_INTERVAL = timedelta(hours=1)  # after a failed refresh
+REFRESH_LEASE = timedelta(hours=1)  # a topic being refreshed is left alone by other runs this long
 
 # --- Voting helpers ---
+_round_memo = (None, 0.0)  # (round, monotonic time until which it is trusted)
+
+def current_round():
+    # rounds are numbered from 1; proposals made before rounds existed have none (None).
+    # Memoized for one vote flush interval like the known keywords (VoteBuffer.remember):
+    # weekly winners waits VOTE_SETTLE_SECONDS after closing a round, which covers it
+    global _round_memo
+    number, trusted_until = _round_memo
+    if trusted_until > time.monotonic():
+        return number
+    state = voting_rounds.find_one({"_id": "current"}, {"round": 1})
+    number = state.get("round") if state else None
+    _round_memo = (number, time.monotonic() + vote_buffer.interval)
+    return number
+
+def _with_token(username, write):
+    """
+    Spend one of username's tokens and run write(session) as one unit.
+    By default the token is given back if write reports that nothing was
+    written or fails; with VOTING_TRANSACTIONS=1 (replica set only) both writes
+    commit or abort together. Returns write's result, None without a token.
+    """
+    if VOTING_TRANSACTIONS:
+        def spend_and_write(session):
+            if not use_token(username, session=session):
+                return None
+            result = write(session)
+            if not result:
+                session.abort_transaction()
+            return result
+        with DB_client.start_session() as session:
+            return session.with_transaction(spend_and_write)
+
+    if not use_token(username):
+        return None
+    try:
+        result = write(None)
+    except PyMongoError:
+        refund_token(username)
+        raise
+    if not result:
+        refund_token(username)
+    return result
+
 def add_voting_keyword(keyword, created_by):
-    return voting.insert_one({
+    """Propose a keyword for one of created_by's tokens. Returns its id, None without a token."""
+    voting_id = _with_token(created_by, lambda session: voting.insert_one({
         "keyword": keyword.lower(),
+        "round": current_round(),
         "votes": 1,
         "created_by": created_by,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }).inserted_id
+        "created_at": utcnow()
+    }, session=session).inserted_id)
+    if voting_id:
+        vote_buffer.remember(voting_id)
+    return voting_id
 
-def vote_keyword(voting_id):
-    voting.update_one({"_id": ObjectId(voting_id)}, {"$inc": {"votes": 1}})
+def _keyword_exists(voting_id):
+    # only keywords of the current round take votes
+    if vote_buffer.is_known(voting_id):
+        return True
+    if voting.find_one({"_id": voting_id, "round": current_round()}, {"_id": 1}):
+        vote_buffer.remember(voting_id)
+        return True
+    return False
 
-def get_voting_keywords():
-    return list(voting.find().sort("votes", -1))
+def vote_keyword(voting_id, username):
+    """
+    One vote for one of username's tokens. Returns True if the vote was counted,
+    False if the keyword does not exist (the token is kept), None without a token.
+    Votes go through the buffer in votes.py unless VOTE_FLUSH_INTERVAL=0.
+    """
+    voting_id = ObjectId(voting_id)
+    if vote_buffer.enabled:
+        if not _keyword_exists(voting_id):
+            return False
+        # buffered outside any transaction: a retried commit must not count the vote twice
+        if not use_token(username):
+            return None
+        return vote_buffer.add(voting_id)
+    return _with_token(username, lambda session: voting.update_one(
+        {"_id": voting_id, "round": current_round()}, {"$inc": {"votes": 1}}, session=session
+    ).matched_count == 1)
 
-def clear_voting():
-    voting.delete_many({})
+def get_voting_keywords(page=0, per_page=VOTING_PAGE_SIZE):
+    """
+    One page of the current round's proposals, most votes first, read
+    through the round_votes_id index. Counts include the votes this process
+    has not flushed yet. Returns (keywords, has_more).
+    """
+    query = {"round": current_round()}
+    docs = list(voting.find(query).sort(VOTES_ORDER).skip(page * per_page).limit(per_page + 1))
+    return vote_buffer.merged(docs[:per_page]), len(docs) > per_page
 
 # --- News generation ---
-def new_topic(user_topic, created_by=None):
+def _existing_topic(user_topics, rescore=True):
+    # id of the topic for these keywords, None if it does not exist yet
+    # (a new topic is only created together with its first update, see insert_update)
+    existing_topic = topics.find_one({"keywords": user_topics}, {"_id": 1})
+    if not existing_topic:
+        return None
+    # the refresh engine has just scored this topic, no need to pay for it twice
+    if rescore:
+        check_topic_score(existing_topic["_id"])
+    return existing_topic["_id"]
+
+def _new_topic_doc(user_topics):
+    # a fresh article needs no refresh before the base interval (see scheduler.py)
+    return {"keywords": user_topics, "next_due": utcnow() + REFRESH_BASE_INTERVAL}
+
+def _update_doc(keyword_id, safe, created_by):
+    return {
+        "topic_id": keyword_id,
+        "group": safe["group"],
+        "name": safe["headline"],
+        "summary": safe["summary"],
+        "text": safe["body"],
+        "search_tokens": search_tokens(safe["headline"], safe["summary"], safe["body"]),
+        "score": 1,
+        "update_time": utcnow(),
+        "created_by": created_by
+    }
+
+def insert_update(keyword_id, safe, created_by, user_topics=None):
+    """
+    Store a parsed article (see articles.parse_article) as the newest update
+    of a topic: the topic itself if keyword_id is None (created from
+    user_topics), the full update, its compact feed card, then drop the
+    cached feed pages it changes. Returns the update id.
+    """
+    if keyword_id is None:
+        keyword_id = topics.insert_one(_new_topic_doc(user_topics)).inserted_id
+    doc = _update_doc(keyword_id, safe, created_by)
+    topic_updates.insert_one(doc)
+    feed_cards.insert_one(feed_card(doc))
+    page_cache.invalidate(safe["group"])
+    return doc["_id"]
+
+def new_topic(user_topic, created_by=None, rescore=True):
     try:
         # validate and normalize; returns list[str]
         user_topics = validate_topic_list(user_topic)
@@ -50,105 +236,236 @@ def new_topic(user_topic, created_by=None):
         # reject quietly and log already handled inside validate_topic_list
         return None
 
-    existing_topic = topics.find_one({"keywords": user_topics})
-
-    if existing_topic:
-        keyword_id = existing_topic["_id"]
-        check_topic_score(keyword_id)
-    else:
-        topic = topics.insert_one({"keywords": user_topics})
-        keyword_id = topic.inserted_id
+    keyword_id = _existing_topic(user_topics, rescore)
+    raw_content = AI_client.complete(site="new_topic", cached=False, **article_request(user_topics))
+    try:
+        safe = parse_article(raw_content)
+    except ValueError:
+        return None
+    return insert_update(keyword_id, safe, created_by, user_topics)
 
-    response = AI_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You are a journalist writing in a news style. Max 500 words. "
-                    "Make the first lane only one word that will categorise the article into one of these 6 groups:"
-                    "[Politics_Conflicts, Economy_Business, Science_Technology, Environment_Climate, Sports, Culture_Society]"
-                    "After that leave a empty line and make the next line a headline. Then leave an empty line and write a brief summary. "
-                    "After that leave another empty line and write the rest of the article and leave two empty lines at the end. "
-                    "After that list the sources. Each source in next line starting with a dash. Do not include any URLs."
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Can you tell me some news about the {user_topics}?"
-            }
-        ]
-    )
+# --- Streaming generation ---
+ARTICLE_SECTIONS = ["group", "headline", "summary"]
 
-    raw_content = response.choices[0].message.content
+def _article_sections(deltas):
+    # same paragraph split as new_topic, but each part is yielded as soon as it is complete:
+    # ("group", ...), ("headline", ...), ("summary", ...), then ("paragraph", ...) for the body
+    buffer = ""
+    index = 0
+    for delta in deltas:
+        buffer += delta
+        while "\n\n" in buffer:
+            part, buffer = buffer.split("\n\n", 1)
+            yield (ARTICLE_SECTIONS[index] if index < len(ARTICLE_SECTIONS) else "paragraph"), part
+            index += 1
+    if buffer:
+        yield (ARTICLE_SECTIONS[index] if index < len(ARTICLE_SECTIONS) else "paragraph"), buffer
 
-    # parse safely (keep original splitting logic, but sanitize)
-    lines = raw_content.splitlines()
-    group = lines[0] if len(lines) > 0 else ""
-    headline = lines[2] if len(lines) > 2 else ""
+def _safe_field(name, value):
+    fields = {"group": "", "headline": "", "summary": "", "body": ""}
+    fields[name] = value
+    return sanitize_ai_output(**fields)[name]
 
-    # summary and body parsing using paragraphs
-    paras = raw_content.split("\n\n")
-    summary = paras[2] if len(paras) > 2 else ""
-    article_body = "\n\n".join(paras[3:]) if len(paras) > 3 else ""
+def stream_new_topic(user_topic, created_by=None, rescore=True):
+    """
+    Streaming variant of new_topic. Yields (event, data) pairs as soon as each
+    part of the article is known: "group", "headline", "summary", one
+    "paragraph" per body paragraph, then "done" with the new update id, or
+    "error". Every part is saved to Drafts on arrival, so an interrupted
+    generation keeps what was already produced.
+    """
+    try:
+        user_topics = validate_topic_list(user_topic)
+    except ValueError:
+        yield "error", "Invalid topic"
+        return
 
-    # sanitize AI outputs before writing to DB
-    safe = sanitize_ai_output(group, headline, summary, article_body)
+    draft_id = drafts.insert_one({
+        "keywords": user_topics,
+        "status": "generating",
+        "body": [],
+        "created_by": created_by,
+        "started_at": utcnow()
+    }).inserted_id
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    inserted = topic_updates.insert_one({
-        "topic_id": keyword_id,
-        "group": safe["group"],
-        "name": safe["headline"],
-        "summary": safe["summary"],
-        "text": safe["body"],
-        "score": 1,
-        "update_time": timestamp,
-        "created_by": created_by
-    })
+    sections = {"group": "", "headline": "", "summary": ""}
+    body = []
+    try:
+        keyword_id = _existing_topic(user_topics, rescore)
+        deltas = AI_client.stream(
+            site="stream_new_topic", model=ARTICLE_MODEL, messages=article_messages(user_topics)
+        )
+        for name, text in _article_sections(deltas):
+            if name == "paragraph":
+                body.append(text)
+                safe_text = _safe_field("body", text)
+                drafts.update_one({"_id": draft_id}, {"$push": {"body": safe_text}})
+                if safe_text:
+                    yield "paragraph", safe_text
+                continue
+            if name == "headline":
+                text = text.strip().split("\n")[0]
+            if name == "group":
+                text = valid_group(text.strip().split("\n")[0].strip(" #*"))
+            sections[name] = text
+            safe_text = _safe_field(name, text)
+            drafts.update_one({"_id": draft_id}, {"$set": {name: safe_text}})
+            yield name, safe_text
+        # same check as parse_article: no empty article is ever stored
+        if not sections["headline"].strip() or not sections["summary"].strip():
+            parse_failure("missing_fields", "no headline or summary")
+            raise ValueError("Article reply has no headline or summary")
+    except Exception as e:
+        logging.warning("Streaming generation failed for %s: %s", user_topics, e)
+        drafts.update_one({"_id": draft_id}, {"$set": {"status": "failed", "error": str(e)}})
+        yield "error", "Generation failed"
+        return
 
-    return inserted.inserted_id
+    safe = sanitize_ai_output(sections["group"], sections["headline"], sections["summary"], "\n\n".join(body))
+    update_id = insert_update(keyword_id, safe, created_by, user_topics)
+    drafts.update_one({"_id": draft_id}, {"$set": {"status": "complete", "update_id": update_id}})
+    yield "done", str(update_id)
 
 # --- Topic searching/updating ---
-def search_by_keyword(keyword):
+def _page(cursor, limit):
+    # fetch one extra row to find out whether there is a next page
+    return split_page(list(cursor.limit(limit + 1)), limit)
+
+def search_by_keyword(keyword, limit=SEARCH_PAGE_SIZE, cursor=None):
+    """
+    Updates of every topic tagged with keyword, newest first.
+    Two round trips: matching topic ids, then one $in query with a merged sort.
+    Returns (results, next_cursor); next_cursor is None on the last page.
+    """
     try:
         keyword = validate_keyword(keyword)
     except ValueError:
-        return []
+        return [], None
 
-    results = []
+    topic_ids = [t["_id"] for t in topics.find({"keywords": keyword}, {"_id": 1})]
+    if not topic_ids:
+        return [], None
 
-    for topic in topics.find({"keywords": keyword}):
-        updates = topic_updates.find(
-            {"topic_id": topic["_id"]}
-        ).sort("update_time", -1)
-        for text in updates:
-            results.append({
-                "id": str(text["_id"]),
-                "headline": text["name"],
-                "summary": text["summary"],
-                "text": text["text"],
-                "update_time": text["update_time"]
-            })
+    try:
+        query = keyword_query(topic_ids, cursor)
+    except ValueError:
+        return [], None
+    updates, next_cursor = _page(topic_updates.find(query, SEARCH_FIELDS).sort(NEWEST_FIRST), limit)
+    return keyword_results(updates), next_cursor
+
+def text_search(query, limit=SEARCH_PAGE_SIZE, cursor=None):
+    """
+    Full-text search over headlines, summaries and article bodies, using the
+    weighted text index declared in indexes.py. Supports "quoted phrases" and
+    prefix* terms; prefixes are matched against the search_tokens index.
+    Results are ranked by relevance; a query made of prefixes only has no
+    text score and is returned newest first instead.
+    Returns (results, next_cursor).
+    """
+    try:
+        parsed = validate_search_query(query)
+        kind, spec = text_query(parsed, limit, cursor)
+    except ValueError:
+        return [], None
 
-    return results
+    if kind == "find":
+        updates, next_cursor = _page(
+            topic_updates.find(spec, SEARCH_FIELDS).sort(NEWEST_FIRST),
+            limit
+        )
+    else:
+        updates, next_cursor = score_page(list(topic_updates.aggregate(spec)), limit)
+    return text_results(updates), next_cursor
 
 def check_topic_score(topic_id):
+    # score of the topic's latest update, None if the topic has no update to score
     latest_topic_update = topic_updates.find_one({"topic_id": topic_id}, sort=[("update_time", -1)])
-    response = AI_client.chat.completions.create(
+    if latest_topic_update is None:
+        return None
+    content = AI_client.complete(
+        site="check_topic_score",
         model="gpt-4",
         messages=[
             {"role": "system", "content": "Return only a number from 0 to 1, rounded to 2 decimals."},
             {"role": "user", "content": f"Here is my text: {latest_topic_update['summary']}. Score it."},
         ]
     )
-    score = float(response.choices[0].message.content.strip())
+    score = float(content.strip())
     topic_updates.update_one(
         {"_id": latest_topic_update["_id"]},
         {"$set": {"score": score}}
     )
     return score
 
+def _latest_updates(topic_ids):
+    # newest update per topic in one aggregation instead of a find_one per topic
+    pipeline = [
+        {"$match": {"topic_id": {"$in": list(topic_ids)}}},
+        {"$sort": {"topic_id": 1, "update_time": -1}},
+        {"$group": {
+            "_id": "$topic_id",
+            "update_id": {"$first": "$_id"},
+            "summary": {"$first": "$summary"}
+        }}
+    ]
+    return {doc["_id"]: doc for doc in topic_updates.aggregate(pipeline)}
+
+def _parse_scores(content, expected):
+    # strict: a JSON array of exactly `expected` numbers in [0, 1]
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+    scores = json.loads(content)
+    if not isinstance(scores, list) or len(scores) != expected:
+        raise ValueError(f"expected a list of {expected} scores")
+    for score in scores:
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 1:
+            raise ValueError(f"invalid score {score!r}")
+    return [float(score) for score in scores]
+
+def check_topic_scores(topic_ids):
+    """
+    Score the latest update of every topic in topic_ids with a single completion.
+    Returns {topic_id: score}; topics without updates are left out.
+    If the reply is not a valid JSON array of scores, each topic is scored on its own.
+    """
+    latest = _latest_updates(topic_ids)
+    items = [latest[topic_id] for topic_id in topic_ids if topic_id in latest]
+    if not items:
+        return {}
+    if len(items) == 1:
+        return {items[0]["_id"]: check_topic_score(items[0]["_id"])}
+
+    numbered = "\n".join(f"{i}. {item['summary']}" for i, item in enumerate(items, start=1))
+    content = AI_client.complete(
+        site="check_topic_scores",
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": (
+                "You will get numbered texts. Score each one from 0 to 1, rounded to 2 decimals. "
+                "Return only a JSON array with one number per text, in the same order."
+            )},
+            {"role": "user", "content": f"Here are {len(items)} texts:\n{numbered}"},
+        ]
+    )
+    try:
+        scores = _parse_scores(content, len(items))
+    except ValueError as e:
+        logging.warning("Batch score reply unusable (%s), scoring %d topics one by one", e, len(items))
+        results = {}
+        for item in items:
+            try:
+                results[item["_id"]] = check_topic_score(item["_id"])
+            except Exception as e:
+                logging.warning("Scoring failed for topic %s: %s", item["_id"], e)
+        return results
+
+    topic_updates.bulk_write(
+        [UpdateOne({"_id": item["update_id"]}, {"$set": {"score": score}}) for item, score in zip(items, scores)],
+        ordered=False
+    )
+    return {item["_id"]: score for item, score in zip(items, scores)}
+
 def update_using_id(topic_id):
     # if a string was passed erroneously, try safe conversion
     if isinstance(topic_id, str):
@@ -157,19 +474,275 @@ def update_using_id(topic_id):
         except Exception:
             return None
     keywords = topics.find_one({"_id": topic_id})["keywords"]
-    new_topic(",".join(keywords))
-
-def full_update():
-    updates = 0
-    for topic in topics.find():
-        topic_id = topic["_id"]
-        latest_topic_update = topic_updates.find_one({"topic_id": topic_id}, sort=[("update_time", -1)])
-        if latest_topic_update:
-            score = check_topic_score(topic_id)
-            if score <= 0.5:
-                update_using_id(topic_id)
-                updates += 1
-    print("All topics are relevant" if updates == 0 else f"Updated {updates} topics.")
-
-def get_popular_updates(skip, limit):
-    return list(topic_updates.find().sort("update_time", -1).skip(skip).limit(limit))
+    return new_topic(",".join(keywords), rescore=False)
+
+# --- Refresh engine ---
+def refresh_interval(score, recent_views):
+    # low-scoring topics go stale sooner, much-read topics are worth refreshing more often
+    interval = REFRESH_BASE_INTERVAL * max(score, 0.1) / (1 + math.log1p(max(recent_views, 0)))
+    return min(REFRESH_MAX_INTERVAL, max(REFRESH_MIN_INTERVAL, interval))
+
+def _claim_topics(topic_ids):
+    """
+    Lease topic_ids to this run, leaving out those another run (a second
+    scheduler, a full_update job) is refreshing. next_due moves past the
+    lease as well, so the scheduler does not select them in the meantime;
+    a crashed run's topics are due again once the lease expires.
+    Returns the claimed ids in their original order.
+    """
+    if not topic_ids:
+        return []
+    now = utcnow()
+    lease = ObjectId()
+    topics.update_many(
+        {"_id": {"$in": topic_ids}, "refresh_lease_until": {"$not": {"$gt": now}}},
+        {"$set": {"refresh_lease": lease, "refresh_lease_until": now + REFRESH_LEASE, "next_due": now + REFRESH_LEASE}}
+    )
+    claimed = set(topics.distinct("_id", {"_id": {"$in": topic_ids}, "refresh_lease": lease}))
+    return [topic_id for topic_id in topic_ids if topic_id in claimed]
+
+def _record_refresh(scores, failed_ids):
+    # store last score / refresh time, compute next_due and release the lease for every topic of a run
+    if not scores and not failed_ids:
+        return
+    now = utcnow()
+    views = {
+        t["_id"]: t.get("recent_views", 0)
+        for t in topics.find({"_id": {"$in": list(scores)}}, {"recent_views": 1})
+    }
+    ops = [
+        UpdateOne({"_id": topic_id}, {
+            "$set": {
+                "last_score": score,
+                "last_refreshed": now,
+                "next_due": now + refresh_interval(score, views.get(topic_id, 0))
+            },
+            # views counted during the run are kept for the next interval
+            "$inc": {"recent_views": -views.get(topic_id, 0)},
+            "$unset": {"refresh_lease": "", "refresh_lease_until": ""}
+        })
+        for topic_id, score in scores.items()
+    ]
+    ops += [
+        UpdateOne({"_id": topic_id}, {
+            "$set": {"next_due": now + REFRESH_RETRY_INTERVAL},
+            "$unset": {"refresh_lease": "", "refresh_lease_until": ""}
+        })
+        for topic_id in failed_ids
+    ]
+    topics.bulk_write(ops, ordered=False)
+
+def _regenerate(topic_id):
+    if update_using_id(topic_id) is None:
+        raise RuntimeError("regeneration produced no update")
+
+def refresh_topics(topic_ids, max_workers=None, batch_size=None):
+    """
+    Score the given topics in batches and regenerate the ones that are no longer
+    relevant, all on one bounded thread pool. A failing topic is logged and
+    counted, it never aborts the run. Topics another run is refreshing are
+    skipped (see _claim_topics).
+    Every topic's last_score, last_refreshed and next_due are updated afterwards.
+    Returns a summary dict: topics, skipped, scored, regenerated, failed, errors, wall_time, llm.
+    """
+    started = time.perf_counter()
+    llm_before = metrics.snapshot()
+    batch_size = batch_size or SCORE_BATCH_SIZE
+    claimed = _claim_topics(topic_ids)
+    summary = {
+        "topics": len(claimed),
+        "skipped": len(topic_ids) - len(claimed),
+        "scored": 0,
+        "regenerated": 0,
+        "failed": 0,
+        "errors": [],
+        "wall_time": 0.0
+    }
+    outcomes = {}  # topic_id -> relevance after the run (1.0 once regenerated)
+    failed_ids = set()
+
+    def fail(topic_id, error):
+        logging.warning("Refresh failed for topic %s: %s", topic_id, error)
+        outcomes.pop(topic_id, None)
+        failed_ids.add(topic_id)
+        summary["failed"] += 1
+        summary["errors"].append({"topic_id": str(topic_id), "error": str(error)})
+
+    if claimed:
+        with ThreadPoolExecutor(max_workers=max_workers or REFRESH_WORKERS) as pool:
+            batches = [claimed[i:i + batch_size] for i in range(0, len(claimed), batch_size)]
+            score_futures = {pool.submit(check_topic_scores, batch): batch for batch in batches}
+            regen_futures = {}
+            # regenerations start as soon as their batch is scored
+            for future in as_completed(score_futures):
+                batch = score_futures[future]
+                try:
+                    scores = future.result()
+                except Exception as e:
+                    for topic_id in batch:
+                        fail(topic_id, e)
+                    continue
+                for topic_id in batch:
+                    if topic_id not in scores:
+                        fail(topic_id, "not scored")
+                        continue
+                    summary["scored"] += 1
+                    outcomes[topic_id] = scores[topic_id]
+                    if scores[topic_id] <= RELEVANCE_THRESHOLD:
+                        regen_futures[pool.submit(_regenerate, topic_id)] = topic_id
+            for future in as_completed(regen_futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    fail(regen_futures[future], e)
+                    continue
+                outcomes[regen_futures[future]] = 1.0
+                summary["regenerated"] += 1
+
+    _record_refresh(outcomes, failed_ids)
+
+    summary["wall_time"] = round(time.perf_counter() - started, 3)
+    # LLM calls made by this process during the run (per site and model)
+    summary["llm"] = metrics_diff(llm_before, metrics.snapshot())
+    logging.info(
+        "Refresh done: %d scored, %d regenerated, %d failed in %.1fs",
+        summary["scored"], summary["regenerated"], summary["failed"], summary["wall_time"]
+    )
+    return summary
+
+def full_update(max_workers=None, batch_size=None):
+    # only topics that already have an update can be scored
+    with_updates = set(topic_updates.distinct("topic_id"))
+    topic_ids = [t["_id"] for t in topics.find({}, {"_id": 1}) if t["_id"] in with_updates]
+    return refresh_topics(topic_ids, max_workers=max_workers, batch_size=batch_size)
+
+_feed_cards_ready = None  # None until checked; while False, checked again on every page
+
+def feed_cards_ready():
+    """Whether Feed_cards has been filled; once it has, it stays so for the life of the process."""
+    global _feed_cards_ready
+    if not _feed_cards_ready:
+        ready = feed_cards.find_one({}, {"_id": 1}) is not None
+        if not ready and _feed_cards_ready is None:
+            logging.warning("Feed_cards is empty, reading the feed from Topic_updates: run `python migrations.py feed-cards`")
+        _feed_cards_ready = ready
+    return _feed_cards_ready
+
+def get_popular_updates(cursor=None, limit=10, group=None, since=None, until=None):
+    """
+    One feed page, newest first, optionally restricted to a group and to
+    update_time in [since, until). Pages are read from the compact Feed_cards
+    collection (headline, summary, update_time), or from Topic_updates with the
+    same projection while Feed_cards has not been backfilled. Keyset pagination:
+    every page costs the same, and rows inserted while a reader scrolls never
+    shift the pages they have not fetched yet.
+    Returns (updates, next_cursor); raises ValueError on an invalid cursor.
+    """
+    query = feed_query(cursor, group, since, until)
+    if feed_cards_ready():
+        return _page(feed_cards.find(query, FEED_FIELDS).sort(NEWEST_FIRST), limit)
+    updates, next_cursor = _page(topic_updates.find(query, UPDATE_FEED_FIELDS).sort(NEWEST_FIRST), limit)
+    return update_cards(updates), next_cursor
+
+# --- Weekly winners ---
+def _close_voting_round():
+    """
+    Start a new voting round and return the number of the closed one.
+    Nothing is moved: proposals keep their round, so votes still buffered
+    in the web processes land on the closed round's counts. A retried
+    weekly_winners job (lost lease) gets back the round its first attempt
+    closed instead of closing the new one.
+    """
+    global _round_memo
+    state = voting_rounds.find_one({"_id": "current"}) or {}
+    if "closing" in state:
+        return state["closing"]
+    closed = state.get("round")
+    voting_rounds.update_one(
+        {"_id": "current", "closing": {"$exists": False}},
+        {"$set": {"closing": closed, "started_at": utcnow()}, "$inc": {"round": 1}},
+        upsert=True
+    )
+    _round_memo = (None, 0.0)
+    return closed
+
+def _finish_voting_round(closed):
+    # the closed round is kept until the next one closes, older proposals are dropped
+    voting_rounds.update_one({"_id": "current"}, {"$unset": {"closing": ""}, "$set": {"last_closed": closed}})
+    voting.delete_many({"round": {"$nin": [closed, (closed or 0) + 1]}})
+
+def _generate_article(user_topics):
+    raw_content = AI_client.complete(site="weekly_winners", cached=False, **article_request(user_topics))
+    return parse_article(raw_content)
+
+def run_weekly_winners(limit=5, max_workers=None):
+    """
+    Turn the top voted keywords into articles, then start a new voting round.
+    The round is closed first and the winners are read once the votes
+    buffered in every process have been flushed (VOTE_SETTLE_SECONDS), so
+    no vote is lost or counted in the wrong round. Winners are validated up
+    front, existing topics re-scored in one batch, articles generated
+    concurrently and everything written with bulk inserts.
+    Returns a summary dict for the job that ran it.
+    """
+    closed = _close_voting_round()
+    # also repeated by a retried job: a few extra tokens beat a week without any
+    reset_all_tokens()
+    time.sleep(VOTE_SETTLE_SECONDS)
+
+    top_keywords = list(
+        voting.find({"round": closed}, {"keyword": 1, "created_by": 1, "votes": 1}).sort(VOTES_ORDER).limit(limit)
+    )
+    winners = {}  # normalized topic list -> created_by, duplicates collapse
+    for k in top_keywords:
+        try:
+            toks = validate_topic_list(k["keyword"])
+        except ValueError:
+            continue
+        winners.setdefault(tuple(toks), k["created_by"])
+
+    # one query for the topics that already exist
+    topic_ids = {
+        tuple(t["keywords"]): t["_id"]
+        for t in topics.find({"keywords": {"$in": [list(toks) for toks in winners]}}, {"keywords": 1})
+        if tuple(t["keywords"]) in winners
+    }
+    existing = list(topic_ids.values())
+
+    generated, failed = {}, []
+    with ThreadPoolExecutor(max_workers=max_workers or REFRESH_WORKERS) as pool:
+        # like new_topic, existing topics get their latest update re-scored
+        scoring = pool.submit(check_topic_scores, existing) if existing else None
+        futures = {pool.submit(_generate_article, list(toks)): toks for toks in winners}
+        for future in as_completed(futures):
+            toks = futures[future]
+            try:
+                generated[toks] = future.result()
+            except Exception as e:
+                logging.warning("Winner article failed for %s: %s", list(toks), e)
+                failed.append(",".join(toks))
+        if scoring is not None:
+            try:
+                scoring.result()
+            except Exception as e:
+                logging.warning("Re-scoring winner topics failed: %s", e)
+
+    # one insert for the new topics, only those whose article came through
+    missing = [toks for toks in generated if toks not in topic_ids]
+    if missing:
+        inserted = topics.insert_many([_new_topic_doc(list(toks)) for toks in missing])
+        topic_ids.update(zip(missing, inserted.inserted_ids))
+    docs = [_update_doc(topic_ids[toks], safe, winners[toks]) for toks, safe in generated.items()]
+    if docs:
+        topic_updates.insert_many(docs)
+        feed_cards.insert_many([feed_card(doc) for doc in docs])
+        for group in {doc["group"] for doc in docs}:
+            page_cache.invalidate(group)
+    _finish_voting_round(closed)
+
+    return {
+        "winners": [k["keyword"] for k in top_keywords],
+        "created": [str(doc["_id"]) for doc in docs],
+        "failed": failed,
+        "round": closed
+    }
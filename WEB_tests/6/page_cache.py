@@ -0,0 +1,132 @@
+# page_cache.py
+# Cache for rendered feed pages and articles, with ETags for conditional GETs.
+# Feed ETags are derived from the newest update of the group, so they change
+# (in every process) as soon as a new article is inserted, and from the group's
+# revision, which migrations bump when they rewrite existing feed cards.
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from database import feed_cards, feed_revisions
+from metrics import metrics
+
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "300"))  # seconds; 0 disables caching (ETags stay)
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "2000"))  # entries, 0 keeps only the ETags
+VERSION_TTL = 5.0  # seconds a group's newest update is trusted before asking Mongo again
+
+
+class MemoryBackend:
+    """
+    In-process LRU with per-entry expiry. Any object with the same
+    get / set / delete_prefix methods (e.g. a Redis adapter) can replace it.
+    """
+
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+def newest_query(group):
+    # filter, projection and sort of the newest feed card of a group (None = all)
+    return {"group": group} if group else {}, {"update_time": 1}, [("update_time", -1), ("_id", -1)]
+
+
+def revision_id(group):
+    # Feed_revisions _id of a group's feed; the home feed (None) has its own
+    return group or "Home"
+
+
+def bump_revisions(groups):
+    """Change the ETags of these groups' feeds and of the home feed, after their cards were rewritten."""
+    for group in {revision_id(g) for g in groups} | {revision_id(None)}:
+        feed_revisions.update_one({"_id": group}, {"$inc": {"rev": 1}}, upsert=True)
+
+
+class PageCache:
+    def __init__(self, backend=None, ttl=PAGE_CACHE_TTL):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self._versions = {}  # group -> (expires_at, version); callers only pass the known groups
+        self._lock = threading.Lock()
+
+    def cached_version(self, group):
+        with self._lock:
+            memo = self._versions.get(group)
+        return memo[1] if memo and memo[0] > time.monotonic() else None
+
+    def remember_version(self, group, newest, revision=None):
+        newest_id = f"{newest['update_time']}/{newest['_id']}" if newest else "empty"
+        version = f"{newest_id}/{revision.get('rev', 0) if revision else 0}"
+        with self._lock:
+            self._versions[group] = (time.monotonic() + VERSION_TTL, version)
+        return version
+
+    def feed_version(self, group=None):
+        """(update_time, _id) of the newest update in the group (None = all), via the feed index, and its revision."""
+        version = self.cached_version(group)
+        if version is None:
+            query, fields, sort = newest_query(group)
+            version = self.remember_version(
+                group,
+                feed_cards.find_one(query, fields, sort=sort),
+                feed_revisions.find_one({"_id": revision_id(group)})
+            )
+        return version
+
+    def feed_etag(self, group, *params, version=None):
+        # version can be passed in by callers that looked it up themselves (asgi.py)
+        version = version or self.feed_version(group)
+        raw = "|".join(str(p) for p in (group, version, *params))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    @staticmethod
+    def article_etag(article):
+        # id and timestamp identify an article; rev is bumped when a migration rewrites it (e.g. resanitize)
+        raw = f"{article['_id']}/{article['update_time']}/{article.get('rev', 0)}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        metrics.count("page_cache_total", result="hit" if value is not None else "miss")
+        return value
+
+    def set(self, key, value):
+        if self.ttl > 0:
+            self.backend.set(key, value, self.ttl)
+
+    def invalidate(self, group):
+        """Called when an update is inserted: drop the group's and the home feed's pages."""
+        with self._lock:
+            self._versions.pop(group, None)
+            self._versions.pop(None, None)
+        self.backend.delete_prefix(f"feed:{group}:")
+        self.backend.delete_prefix("feed:None:")
+
+
+# Shared by the app and by news (which invalidates after inserts)
+page_cache = PageCache()
@@ -0,0 +1,135 @@
+# profiling.py
+# Opt-in request profiling for the Flask app: wall time, MongoDB round trips
+# and template render time per request, reported as Server-Timing headers and
+# as a rolling slow-endpoint report. Sampled cProfile dumps can be switched on at runtime.
+import os
+import time
+import random
+import cProfile
+import logging
+import threading
+from collections import defaultdict, deque
+from flask import request, template_rendered, before_render_template
+from db_timing import request_local as _local
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+WINDOW = 200  # requests remembered per endpoint
+
+# Runtime switches, changed through configure() (admin URL in app.py)
+settings = {
+    "enabled": os.getenv("PROFILE_REQUESTS", "0") == "1",
+    "sample_rate": 0.0,  # share of requests dumped with cProfile
+}
+
+_lock = threading.Lock()
+_windows = defaultdict(lambda: deque(maxlen=WINDOW))  # endpoint -> recent request stats
+_profiler_busy = threading.Lock()  # only one cProfile can run at a time
+
+
+def _before_render(sender, template, context, **extra):
+    if getattr(_local, "stats", None) is not None:
+        _local.render_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    started = getattr(_local, "render_started", None)
+    if getattr(_local, "stats", None) is not None and started is not None:
+        _local.stats["render_seconds"] += time.perf_counter() - started
+        _local.render_started = None
+
+
+def _start():
+    if not settings["enabled"]:
+        return
+    _local.stats = {"db_calls": 0, "db_seconds": 0.0, "render_seconds": 0.0}
+    _local.started = time.perf_counter()
+    _local.profiler = None
+    if settings["sample_rate"] and random.random() < settings["sample_rate"] and _profiler_busy.acquire(blocking=False):
+        _local.profiler = cProfile.Profile()
+        try:
+            _local.profiler.enable()
+        except ValueError:  # another profiler (e.g. a debugger) is active
+            _local.profiler = None
+            _profiler_busy.release()
+
+
+def _dump_profile(endpoint):
+    profiler = _local.profiler
+    profiler.disable()
+    _profiler_busy.release()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{endpoint}-{int(time.time() * 1000)}.prof")
+    profiler.dump_stats(path)
+    logging.info("Wrote request profile %s", path)
+
+
+def _finish(response):
+    stats = getattr(_local, "stats", None)
+    if stats is None:
+        return response
+    wall = time.perf_counter() - _local.started
+    endpoint = request.endpoint or "unknown"
+    if _local.profiler is not None:
+        _dump_profile(endpoint)
+        _local.profiler = None
+
+    response.headers["Server-Timing"] = (
+        f"app;dur={wall * 1000:.1f}, "
+        f'db;dur={stats["db_seconds"] * 1000:.1f};desc="{stats["db_calls"]} queries", '
+        f"tpl;dur={stats['render_seconds'] * 1000:.1f}"
+    )
+    with _lock:
+        _windows[endpoint].append({"wall": wall, **stats})
+    _local.stats = None
+    return response
+
+
+def _cleanup(exc):
+    # after_request is skipped when a view raises; never leak state into the next request
+    if getattr(_local, "profiler", None) is not None:
+        _local.profiler.disable()
+        _profiler_busy.release()
+        _local.profiler = None
+    _local.stats = None
+
+
+def install(app):
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_cleanup)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+
+def configure(enabled=None, sample_rate=None):
+    if enabled is not None:
+        settings["enabled"] = enabled
+    if sample_rate is not None:
+        settings["sample_rate"] = min(1.0, max(0.0, sample_rate))
+    return dict(settings)
+
+
+def _pct(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+def slow_endpoints(top=10) -> list:
+    """Endpoints ordered by p95 wall time over their last WINDOW requests."""
+    with _lock:
+        windows = {endpoint: list(rows) for endpoint, rows in _windows.items()}
+    report = []
+    for endpoint, rows in windows.items():
+        walls = [r["wall"] for r in rows]
+        report.append({
+            "endpoint": endpoint,
+            "requests": len(rows),
+            "p50_ms": round(_pct(walls, 50) * 1000, 1),
+            "p95_ms": round(_pct(walls, 95) * 1000, 1),
+            "max_ms": round(max(walls) * 1000, 1),
+            "avg_db_calls": round(sum(r["db_calls"] for r in rows) / len(rows), 1),
+            "avg_db_ms": round(sum(r["db_seconds"] for r in rows) / len(rows) * 1000, 1),
+            "avg_render_ms": round(sum(r["render_seconds"] for r in rows) / len(rows) * 1000, 1),
+        })
+    report.sort(key=lambda r: r["p95_ms"], reverse=True)
+    return report[:top]
@@ -0,0 +1,184 @@
+# queries.py
+# MongoDB query specs for the feed and the searches: filters, projections,
+# sorts, cursors and result shaping. Pure functions with no I/O, so the Flask
+# app (through news.py) and the async app (asgi.py) run exactly the same queries.
+import re
+import json
+import base64
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+SEARCH_PAGE_SIZE = 20
+# how the feed shows update_time: the layout of the legacy string timestamps, in UTC
+FEED_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+NEWEST_FIRST = [("update_time", -1), ("_id", -1)]
+
+# search results list headlines and summaries; the article body stays in MongoDB
+SEARCH_FIELDS = {"name": 1, "summary": 1, "update_time": 1}
+FEED_FIELDS = {"headline": 1, "summary": 1, "update_time": 1}
+# the same page read from Topic_updates, until `migrations.py feed-cards` has run
+UPDATE_FEED_FIELDS = {"name": 1, "summary": 1, "update_time": 1}
+
+
+# --- Pagination helpers ---
+# Lists are ordered by (update_time, _id) descending; a cursor is the last row of a page
+def encode_cursor(doc):
+    t = doc["update_time"]
+    payload = {
+        "t": t.isoformat() if isinstance(t, datetime) else t,
+        "d": isinstance(t, datetime),
+        "id": str(doc["_id"])
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (update_time, ObjectId); raises ValueError on a tampered or malformed cursor."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        t = datetime.fromisoformat(payload["t"]) if payload["d"] else str(payload["t"])
+        return t, ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after_cursor(cursor):
+    # filter for rows strictly after the cursor in (update_time desc, _id desc) order
+    if not cursor:
+        return {}
+    t, oid = decode_cursor(cursor)
+    return {"$or": [
+        {"update_time": {"$lt": t}},
+        {"update_time": t, "_id": {"$lt": oid}}
+    ]}
+
+
+def after_score_cursor(cursor):
+    # same idea for relevance-ranked lists, ordered by (relevance, _id) descending
+    if not cursor:
+        return {}
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        score, oid = float(payload["s"]), ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+    return {"$or": [
+        {"relevance": {"$lt": score}},
+        {"relevance": score, "_id": {"$lt": oid}}
+    ]}
+
+
+def split_page(docs, limit):
+    # docs were fetched with limit + 1 to find out whether there is a next page
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def score_page(updates, limit):
+    # relevance-ranked counterpart of split_page
+    if len(updates) <= limit:
+        return updates, None
+    last = updates[limit - 1]
+    next_cursor = base64.urlsafe_b64encode(
+        json.dumps({"s": last["relevance"], "id": str(last["_id"])}).encode()
+    ).decode()
+    return updates[:limit], next_cursor
+
+
+# --- Feed ---
+def feed_query(cursor, group, since, until):
+    """Feed_cards (or Topic_updates) filter of one feed page. Raises ValueError on an invalid cursor."""
+    query = after_cursor(cursor)
+    if group:
+        query["group"] = group
+    if since or until:
+        # range scan on the update_time index (needs native dates, see migrations.py)
+        query["update_time"] = {}
+        if since:
+            query["update_time"]["$gte"] = since
+        if until:
+            query["update_time"]["$lt"] = until
+    return query
+
+
+def update_cards(updates):
+    # Topic_updates read with UPDATE_FEED_FIELDS, in the shape of feed cards
+    return [{
+        "_id": u["_id"],
+        "headline": u["name"],
+        "summary": u["summary"],
+        "update_time": u["update_time"]
+    } for u in updates]
+
+
+def feed_items(cards):
+    # the JSON items of /api/news; time is formatted here, not by the JSON encoder
+    return [{
+        "id": str(card["_id"]),
+        "headline": card["headline"],
+        "summary": card["summary"],
+        "time": card["update_time"].strftime(FEED_TIME_FORMAT)
+        if isinstance(card["update_time"], datetime) else card["update_time"]
+    } for card in cards]
+
+
+# --- Keyword search ---
+def keyword_query(topic_ids, cursor):
+    """Topic_updates filter for the updates of topic_ids. Raises ValueError on an invalid cursor."""
+    return {"topic_id": {"$in": topic_ids}, **after_cursor(cursor)}
+
+
+def keyword_results(updates):
+    return [{
+        "id": str(u["_id"]),
+        "headline": u["name"],
+        "summary": u["summary"],
+        "update_time": u["update_time"]
+    } for u in updates]
+
+
+# --- Full-text search ---
+def search_tokens(*texts):
+    """
+    The distinct lowercase words of an update (headline, summary and body),
+    stored as Topic_updates.search_tokens for prefix searches. Hyphenated and
+    underscored words are kept whole and also split into their parts.
+    """
+    words = set(re.findall(r"[\w-]+", " ".join(texts).lower()))
+    return sorted(words | {part for word in words for part in re.split(r"[-_]", word) if part})
+
+
+def _prefix_filter(prefixes):
+    # every prefix has to start a word of the update; anchored and case-sensitive
+    # on lowercase tokens, so each clause is a range scan of the search_tokens index
+    return [{"search_tokens": {"$regex": f"^{re.escape(p)}"}} for p in prefixes]
+
+
+def text_query(parsed, limit, cursor):
+    """
+    The MongoDB query of a parsed search (security.validate_search_query):
+    ("find", filter) for prefix-only queries, else ("aggregate", pipeline)
+    fetching limit + 1 rows. Raises ValueError on an invalid cursor.
+    """
+    words = parsed["terms"] + [f'"{phrase}"' for phrase in parsed["phrases"]]
+    prefix_clauses = _prefix_filter(parsed["prefixes"])
+    if not words:
+        return "find", {"$and": prefix_clauses + [after_cursor(cursor)]}
+    return "aggregate", [
+        {"$match": {"$and": [{"$text": {"$search": " ".join(words)}}] + prefix_clauses}},
+        {"$project": {**SEARCH_FIELDS, "relevance": {"$meta": "textScore"}}},
+        {"$match": after_score_cursor(cursor)},
+        {"$sort": {"relevance": -1, "_id": -1}},
+        {"$limit": limit + 1}
+    ]
+
+
+def text_results(updates):
+    return [{
+        "id": str(u["_id"]),
+        "headline": u["name"],
+        "summary": u["summary"],
+        "update_time": u["update_time"],
+        "relevance": round(u.get("relevance", 0.0), 3)
+    } for u in updates]
@@ -0,0 +1,65 @@
+# scheduler.py
+# Incremental refresh: instead of re-scoring the whole catalogue (full_update),
+# only topics whose next_due time has passed are refreshed on each tick.
+#   python scheduler.py --interval 60
+import time
+import logging
+import argparse
+from database import topics, topic_updates, metrics_store, utcnow
+from metrics import MetricsPublisher
+from news import refresh_topics, AI_client, REFRESH_MAX_INTERVAL
+
+
+class RefreshScheduler:
+    """
+    Every tick refreshes the topics whose Topics.next_due has passed, earliest
+    first, read straight from the next_due index: the cost of a tick depends
+    on how many topics are due, not on the size of the catalogue.
+    refresh_topics leases the topics it refreshes, so another scheduler or a
+    full_update job running meanwhile skips them, and keeps next_due up to
+    date (see news._claim_topics and news.refresh_interval).
+    """
+
+    def __init__(self, batch_limit=500):
+        self.batch_limit = batch_limit
+
+    def due(self, now):
+        # {$not: {$gt}} also matches topics never scheduled (no next_due), in the same index range
+        return [
+            t["_id"]
+            for t in topics.find({"next_due": {"$not": {"$gt": now}}}, {"_id": 1}).sort("next_due", 1).limit(self.batch_limit)
+        ]
+
+    def tick(self):
+        """Refresh the topics that are due. Returns the run summary, or None if nothing was due."""
+        now = utcnow()
+        due = self.due(now)
+        if not due:
+            return None
+
+        # a topic without any update has nothing to score, look at it again much later
+        with_updates = set(topic_updates.distinct("topic_id", {"topic_id": {"$in": due}}))
+        idle = [topic_id for topic_id in due if topic_id not in with_updates]
+        if idle:
+            topics.update_many({"_id": {"$in": idle}}, {"$set": {"next_due": now + REFRESH_MAX_INTERVAL}})
+            logging.info("Scheduler skipped %d topics without updates", len(idle))
+        ready = [topic_id for topic_id in due if topic_id in with_updates]
+        if not ready:
+            return None
+        return refresh_topics(ready)
+
+    def run(self, interval=60):
+        MetricsPublisher(metrics_store, "scheduler", extra=AI_client.stats).start()
+        while True:
+            summary = self.tick()
+            if summary:
+                logging.info("Scheduler tick: %s", {k: v for k, v in summary.items() if k != "errors"})
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh only the topics that are due")
+    parser.add_argument("--interval", type=int, default=60, help="seconds between ticks")
+    parser.add_argument("--batch-limit", type=int, default=500, help="max topics refreshed per tick")
+    args = parser.parse_args()
+    RefreshScheduler(batch_limit=args.batch_limit).run(args.interval)
@@ -1,8 +1,10 @@
 # security.py
 import re
 import logging
-from typing import List
-from datetime import datetime
+import multiprocessing
+from itertools import islice
+from typing import Iterable, Iterator, List
+from datetime import datetime, timezone
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 
@@ -15,21 +17,66 @@ SAFE_KEYWORD_RE = re.compile(r'^[A-Za-z0-9\s,\-\_]{1,200}$')  # whole field
 # Allowed characters for individual token (lowercase normalized)
 TOKEN_RE = re.compile(r'^[a-z0-9\-\_ ]{1,60}$')  # after lowercasing and trimming
 
+# Full-text queries may also use "quoted phrases" and prefix* terms
+SEARCH_QUERY_RE = re.compile(r'^[A-Za-z0-9\s\-\_"\*]{1,200}$')
+SEARCH_PART_RE = re.compile(r'"([^"]*)"|([^\s"]+)')
+MIN_PREFIX_LEN = 2
+
 # Limits for AI returned fields (enforce types & lengths before writing to DB)
 MAX_GROUP_LEN = 60
 MAX_HEADLINE_LEN = 300
 MAX_SUMMARY_LEN = 1000
 MAX_BODY_LEN = 5000
 
+# One translation table does the whole character clean-up of AI output:
+# drop control characters except tab/newline/CR, drop $, turn braces into parentheses.
+# (Braces and $ are operator signatures themselves, so neutralizing them
+# unconditionally gives the same result as doing it only when a signature is present.)
+AI_OUTPUT_TABLE = str.maketrans({
+    **{c: None for c in [*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20)]},
+    "$": None,
+    "{": "(",
+    "}": ")",
+})
+
+# Topic_updates fields written from AI output, with their limits
+UPDATE_FIELD_LIMITS = {
+    "group": MAX_GROUP_LEN,
+    "name": MAX_HEADLINE_LEN,
+    "summary": MAX_SUMMARY_LEN,
+    "text": MAX_BODY_LEN,
+}
+
 # Mongo operator signatures and suspicious tokens
 MONGO_OPERATOR_SIGNATURES = ["$", "{", "}", "\x00", "$where", "$regex", "function(", "eval(", "__proto__", "$gt", "$lt", "$ne"]
 
+# The rules above compiled into single regexes, so that each check is one scan of the input:
+# any signature at all, and "a signature or a character the field does not allow"
+_SIGNATURES = "|".join(re.escape(sig) for sig in sorted(MONGO_OPERATOR_SIGNATURES, key=len, reverse=True))
+SIGNATURE_RE = re.compile(_SIGNATURES)
+SIGNATURE_RE_I = re.compile(_SIGNATURES, re.IGNORECASE)
+KEYWORD_REJECT_RE = re.compile(rf'{_SIGNATURES}|[^A-Za-z0-9\s,\-\_]')  # complement of SAFE_KEYWORD_RE
+SEARCH_REJECT_RE = re.compile(rf'{_SIGNATURES}|[^A-Za-z0-9\s\-\_"\*]')  # complement of SEARCH_QUERY_RE
+TOKEN_REJECT_RE = re.compile(r'[^\S ]')  # the only thing TOKEN_RE adds once the field passed: no tabs/newlines
+MAX_FIELD_LEN = 200
+MAX_TOKEN_LEN = 60
+
 # -------------------------
 # Input validation helpers
 # -------------------------
 def _log_reject(msg: str, payload: str | None = None) -> None:
     logging.warning(f"{msg} payload={payload!r}")
 
+def _check_field(s: str, reject_re, what: str, label: str | None = None) -> None:
+    # one scan on the accepting path; the failure path finds out which rule fired
+    if len(s) <= MAX_FIELD_LEN and not reject_re.search(s):
+        return
+    if SIGNATURE_RE.search(s):
+        _log_reject(f"Rejected {label or what} (suspicious signature)", s)
+        raise ValueError(f"Suspicious characters in {what}")
+    _log_reject(f"Rejected {label or what} (invalid characters)", s)
+    raise ValueError(f"Invalid characters in {what}")
+
 def validate_keyword(raw: str) -> str:
     """
     Validate a single keyword supplied by user (search term).
@@ -43,16 +90,11 @@ def validate_keyword(raw: str) -> str:
     s = raw.strip()
     if not s:
         raise ValueError("Empty keyword")
-    # We permit spaces and hyphens etc; full string checked against SAFE regex
-    if len(s) > 200:
+    # We permit spaces and hyphens etc; full string checked against SAFE rules
+    if len(s) > MAX_FIELD_LEN:
         _log_reject("Rejected keyword (too long)", s)
         raise ValueError("Keyword too long")
-    if any(sig in s for sig in MONGO_OPERATOR_SIGNATURES):
-        _log_reject("Rejected keyword (suspicious signature)", s)
-        raise ValueError("Suspicious characters in keyword")
-    if not SAFE_KEYWORD_RE.match(s):
-        _log_reject("Rejected keyword (invalid characters)", s)
-        raise ValueError("Invalid characters in keyword")
+    _check_field(s, KEYWORD_REJECT_RE, "keyword")
     return s.lower()
 
 def validate_topic_list(raw: str) -> List[str]:
@@ -69,35 +111,56 @@ def validate_topic_list(raw: str) -> List[str]:
     if not s:
         raise ValueError("Empty topic list")
 
-    if any(sig in s for sig in MONGO_OPERATOR_SIGNATURES):
-        _log_reject("Rejected topic list (suspicious signature)", s)
-        raise ValueError("Suspicious characters in topic list")
-
-    if not SAFE_KEYWORD_RE.match(s):
-        _log_reject("Rejected topic list (invalid characters)", s)
-        raise ValueError("Invalid characters in topic list")
+    _check_field(s, KEYWORD_REJECT_RE, "topic list")
 
-    tokens = [t.strip().lower() for t in s.split(",") if t.strip()]
-    clean = []
-    for t in tokens:
-        if len(t) > 60:
+    # tokenize, normalize, validate and deduplicate (preserving order) in one pass
+    odd_whitespace = TOKEN_REJECT_RE.search(s) is not None  # almost never: skip the per-token check
+    out = {}
+    for t in s.lower().split(","):
+        t = t.strip()
+        if not t or t in out:
+            continue
+        if len(t) > MAX_TOKEN_LEN:
             logging.info("Dropping too-long token from topic list: %r", t)
             continue
-        if not TOKEN_RE.match(t):
+        if odd_whitespace and TOKEN_REJECT_RE.search(t):
             logging.info("Dropping token with invalid chars: %r", t)
             continue
-        clean.append(t)
-    if not clean:
+        out[t] = None
+    if not out:
         _log_reject("No valid tokens after normalization", s)
         raise ValueError("No valid topics provided")
-    # Optionally deduplicate preserving order
-    seen = set()
-    out = []
-    for t in clean:
-        if t not in seen:
-            seen.add(t)
-            out.append(t)
-    return out
+    return list(out)
+
+def validate_search_query(raw: str) -> dict:
+    """
+    Validate a full-text query such as 'ukraine "peace talks" negot*'.
+    Returns lowercased parts: {"terms": [...], "phrases": [...], "prefixes": [...]}.
+    Raises ValueError for invalid input or if nothing searchable remains.
+    """
+    if raw is None or not isinstance(raw, str):
+        raise ValueError("Query must be a string")
+    s = raw.strip()
+    if not s:
+        raise ValueError("Empty query")
+    _check_field(s, SEARCH_REJECT_RE, "query", "search query")
+
+    parsed = {"terms": [], "phrases": [], "prefixes": []}
+    for phrase, word in SEARCH_PART_RE.findall(s.lower()):
+        if phrase:
+            phrase = " ".join(phrase.replace("*", " ").split())
+            if phrase and phrase not in parsed["phrases"]:
+                parsed["phrases"].append(phrase)
+            continue
+        stem = word.strip("*")
+        if not stem or "*" in stem:
+            continue
+        kind = "prefixes" if word.endswith("*") and len(stem) >= MIN_PREFIX_LEN else "terms"
+        if stem not in parsed[kind]:
+            parsed[kind].append(stem)
+    if not any(parsed.values()):
+        raise ValueError("No searchable terms")
+    return parsed
 
 def safe_object_id(id_str: str) -> ObjectId:
     """
@@ -112,14 +175,31 @@ def safe_object_id(id_str: str) -> ObjectId:
         _log_reject("Invalid ObjectId format", id_str)
         raise ValueError("Invalid id format") from e
 
+def parse_utc_date(raw: str | None) -> datetime | None:
+    """
+    Parse an ISO date or datetime from a query string, interpreted as UTC.
+    Returns None for a missing value; raises ValueError on bad input.
+    """
+    if not raw:
+        return None
+    if not isinstance(raw, str) or len(raw) > 40:
+        raise ValueError("Invalid date")
+    try:
+        parsed = datetime.fromisoformat(raw.strip())
+    except ValueError as e:
+        _log_reject("Invalid date format", raw)
+        raise ValueError("Invalid date") from e
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 def contains_mongo_operators(data: str) -> bool:
     """
     Quick boolean heuristic to flag suspicious strings containing operator-like tokens.
     """
     if not isinstance(data, str):
         return False
-    lower = data.lower()
-    return any(sig.lower() in lower for sig in MONGO_OPERATOR_SIGNATURES)
+    return SIGNATURE_RE_I.search(data) is not None
 
 def escape_for_regex(user_input: str) -> str:
     """
@@ -132,6 +212,14 @@ def escape_for_regex(user_input: str) -> str:
 # -------------------------
 # AI output sanitization
 # -------------------------
+def _clean_str(x, limit: int) -> str:
+    # control characters, $ and braces in one translate() call, then truncate and trim
+    if x is None:
+        return ""
+    if not isinstance(x, str):
+        x = str(x)
+    return x.translate(AI_OUTPUT_TABLE)[:limit].strip()
+
 def sanitize_ai_output(group: str, headline: str, summary: str, body: str) -> dict:
     """
     Ensure the AI-produced fields are strings, are within length limits,
@@ -140,20 +228,12 @@ def sanitize_ai_output(group: str, headline: str, summary: str, body: str) -> di
     If a field is missing or too long, it will be truncated.
     """
     def _safe_str(x, limit):
-        if x is None:
-            return ""
-        if not isinstance(x, str):
-            x = str(x)
-        # remove embedded null bytes and control characters except newlines/tabs
-        x = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", "", x)
-        if contains_mongo_operators(x):
-            logging.info("AI output contained suspicious operator; stripping those parts")
-            # neutralize $ and braces to avoid any weirdness (store safe copy)
-            x = x.replace("$", "").replace("{", "(").replace("}", ")")
-        if len(x) > limit:
-            logging.info("Truncating AI output to %d chars", limit)
-            x = x[:limit]
-        return x.strip()
+        if isinstance(x, str):
+            if contains_mongo_operators(x):
+                logging.info("AI output contained suspicious operator; stripping those parts")
+            if len(x) > limit:
+                logging.info("Truncating AI output to %d chars", limit)
+        return _clean_str(x, limit)
 
     return {
         "group": _safe_str(group, MAX_GROUP_LEN),
@@ -162,3 +242,31 @@ def sanitize_ai_output(group: str, headline: str, summary: str, body: str) -> di
         "body": _safe_str(body, MAX_BODY_LEN),
         "sanitized_at": datetime.utcnow().isoformat() + "Z"
     }
+
+def sanitize_update(doc: dict) -> dict:
+    """
+    Sanitized copy of the AI-written fields of a Topic_updates document
+    (only the fields present, plus _id). Same rules as sanitize_ai_output, no logging.
+    """
+    out = {"_id": doc.get("_id")}
+    for field, limit in UPDATE_FIELD_LIMITS.items():
+        if field in doc:
+            out[field] = _clean_str(doc[field], limit)
+    return out
+
+def sanitize_many(docs: Iterable[dict], processes: int = 1, chunksize: int = 256) -> Iterator[tuple]:
+    """
+    Stream (doc, sanitize_update(doc)) pairs for an iterable of documents, in order.
+    With processes > 1 the work is spread over a process pool; docs is read
+    one window at a time, so a cursor over a large collection is not read ahead.
+    """
+    if processes <= 1:
+        for doc in docs:
+            yield doc, sanitize_update(doc)
+        return
+    window = processes * chunksize * 4
+    docs = iter(docs)
+    # spawn, not fork: the caller usually holds an open MongoClient
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        while batch := list(islice(docs, window)):
+            yield from zip(batch, pool.imap(sanitize_update, batch, chunksize))
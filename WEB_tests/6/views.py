@@ -0,0 +1,25 @@
+# views.py
+# Write-buffered article reads. Each read of an article counts towards its
+# topic's views and recent_views (see news.refresh_interval); counting them
+# one $inc per request turns a popular topic into a hot document, so they go
+# through the same kind of buffer as the votes and are flushed in one
+# bulk_write per interval.
+import os
+from database import topics
+from votes import VoteBuffer
+
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "5.0"))  # seconds, must be > 0
+
+
+class ViewBuffer(VoteBuffer):
+    """Pending reads per Topics _id. Reads not flushed yet are lost if the process is killed."""
+
+    def __init__(self, collection, interval=VIEW_FLUSH_INTERVAL):
+        super().__init__(collection, interval)
+
+    def increments(self, n) -> dict:
+        return {"views": n, "recent_views": n}
+
+
+# Shared by every request of the process
+view_buffer = ViewBuffer(topics)
@@ -0,0 +1,108 @@
+# votes.py
+# Write-buffered vote counts. A click adds to an in-memory tally that a
+# background thread flushes with one bulk_write per interval, so a popular
+# keyword costs one $inc per interval instead of one per click.
+# Readers merge the pending tally into the stored counts (see news.get_voting_keywords).
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import Counter
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from database import voting
+
+VOTE_FLUSH_INTERVAL = float(os.getenv("VOTE_FLUSH_INTERVAL", "1.0"))  # seconds; 0 writes every vote directly
+# A vote for a keyword of a closed round can still be accepted for one interval
+# and is written within the next one; closing a round waits this long
+VOTE_SETTLE_SECONDS = 2 * VOTE_FLUSH_INTERVAL + 1.0
+
+
+class VoteBuffer:
+    """
+    Pending increments per Voting _id, flushed every interval seconds.
+    Votes of this process that are not flushed yet are lost if it is killed;
+    a clean exit flushes them.
+    """
+
+    def __init__(self, collection, interval=VOTE_FLUSH_INTERVAL):
+        self.collection = collection
+        self.interval = interval
+        self._known = {}  # id -> until when it is trusted to be in the current round
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="vote-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def is_known(self, voting_id) -> bool:
+        with self._lock:
+            trusted_until = self._known.get(voting_id)
+        return trusted_until is not None and trusted_until > time.monotonic()
+
+    def remember(self, voting_id):
+        # votes for it skip the lookup for one interval, then it is checked again
+        with self._lock:
+            self._known[voting_id] = time.monotonic() + self.interval
+
+    def add(self, voting_id, amount=1) -> bool:
+        with self._lock:
+            self._pending[voting_id] += amount
+            if self._thread is None:
+                self._start()
+        return True
+
+    def pending(self) -> dict:
+        with self._lock:
+            return dict(self._pending)
+
+    def increments(self, n) -> dict:
+        # the $inc of one flushed document
+        return {"votes": n}
+
+    def flush(self) -> int:
+        """Write every pending increment in one bulk_write. Returns the number of votes written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._known.clear()
+        if not pending:
+            return 0
+        try:
+            self.collection.bulk_write(
+                [UpdateOne({"_id": key}, {"$inc": self.increments(n)}) for key, n in pending.items()],
+                ordered=False
+            )
+        except PyMongoError as e:
+            logging.warning("%s flush failed, keeping %d for the next one: %s", type(self).__name__, sum(pending.values()), e)
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        return sum(pending.values())
+
+    def merged(self, docs) -> list:
+        """Voting documents with this process's pending votes added, re-sorted by votes."""
+        pending = self.pending()
+        for doc in docs:
+            doc["votes"] += pending.get(doc["_id"], 0)
+        return sorted(docs, key=lambda d: d["votes"], reverse=True)
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+# Shared by every request of the process
+vote_buffer = VoteBuffer(voting)